@@ -0,0 +1,142 @@
+"""
+End-to-end throughput benchmark against the local replay server, no network needed.
+
+    python -m benchmarks.bench_e2e CASSETTE_DIR [--permits permits.json] [--latency 150] [--capacity 8] [--concurrency 4 8 16] [--adaptive] [--engine scrapy asyncio]
+
+For each HTTP engine and concurrency level the replay server and the crawl run as separate
+processes, so neither one's CPU time distorts the other. Reports permits/sec, server requests
+per permit, crawler CPU time per server request (the per-request overhead of the engine) and
+per-request latency percentiles. Concurrency is fixed unless `--adaptive` is given, then it is
+the session ceiling for the flow controller and the final limit is reported.
+"""
+import argparse
+import json
+from pathlib import Path
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List
+from urllib.request import urlopen
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urlopen(url).read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def crawl(base_url: str, permits: str, concurrency: int, extra_settings: Dict) -> None:
+    """
+    Runs one crawl in this process and prints its measurements as a JSON line.
+    """
+    from scrapy.crawler import CrawlerProcess
+
+    from spider import SETTINGS, Marionfl
+
+    latencies = []
+
+    class TimedMarionfl(Marionfl):
+        async def download(self, request, step):
+            response = await super().download(request, step)
+            latencies.append(response.meta.get("download_latency", 0))
+            return response
+
+    settings = {
+        **SETTINGS, "LOG_LEVEL": "WARNING", "FEEDS": {}, "LEDGER_PATH": None, "PERMIT_CACHE_PATH": None,
+        "CONCURRENT_REQUESTS": 2 * concurrency, "CONCURRENT_REQUESTS_PER_DOMAIN": concurrency, "SESSION_POOL_SIZE": concurrency,
+        "FLOW_CONTROL_ENABLED": False, "MARIONFL_BASE_URL": base_url, **extra_settings,
+    }
+    process = CrawlerProcess(settings=settings)
+    crawler = process.create_crawler(TimedMarionfl)
+    process.crawl(crawler, permits=permits, limit=sys.maxsize)
+    started, cpu_started = time.monotonic(), time.process_time()
+    process.start()
+    elapsed, cpu = time.monotonic() - started, time.process_time() - cpu_started
+    stats = crawler.stats.get_stats()
+    print(json.dumps(dict(
+        elapsed=elapsed,
+        cpu=cpu,
+        items=stats.get("item_scraped_count", 0),
+        errors=stats.get("log_count/ERROR", 0),
+        p50=percentile(latencies, 0.5),
+        p95=percentile(latencies, 0.95),
+        limit=stats.get("flow_control/limit", concurrency),
+    )))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cassettes")
+    parser.add_argument("--permits", default=str(ROOT / "permits.json"))
+    parser.add_argument("--latency", type=float, default=0, help="server delay per response, ms")
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--capacity", type=int, default=0, help="requests the server works on at once, 0 for unlimited")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4])
+    parser.add_argument("--adaptive", action="store_true", help="let the flow controller pick concurrency, up to --concurrency")
+    parser.add_argument("--engine", nargs="+", default=["scrapy"], choices=["scrapy", "asyncio"], help="HTTP_ENGINE to run the session chain on")
+    parser.add_argument("-s", "--set", action="append", default=[], metavar="NAME=VALUE", help="extra Scrapy setting for the crawl")
+    parser.add_argument("--_crawl", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    extra_settings = dict(item.split("=", 1) for item in args.set)
+    if args.adaptive:
+        extra_settings["FLOW_CONTROL_ENABLED"] = True
+    if args._crawl:
+        base_url, concurrency = args._crawl.rsplit(" ", 1)
+        crawl(base_url, args.permits, int(concurrency), extra_settings)
+        return
+
+    print(f"{'engine':>7} {'concurrency':>11} {'permits':>7} {'permits/s':>9} {'req/permit':>10} {'cpu ms/req':>10} {'p50 ms':>7} {'p95 ms':>7} {'errors':>6} {'limit':>5}")
+    for engine, concurrency in [(engine, concurrency) for engine in args.engine for concurrency in args.concurrency]:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, str(ROOT / "replay_server.py"), args.cassettes, "--port", str(port), "--latency", str(args.latency), "--jitter", str(args.jitter), "--capacity", str(args.capacity)],
+            cwd=ROOT, stderr=subprocess.DEVNULL,
+        )
+        try:
+            base_url = f"http://127.0.0.1:{port}/webpermits.dll"
+            wait_for(f"{base_url}/__stats__")
+            command = [sys.executable, "-m", "benchmarks.bench_e2e", args.cassettes, "--permits", args.permits, "--_crawl", f"{base_url} {concurrency}"]
+            if args.adaptive:
+                command.append("--adaptive")
+            for item in args.set + [f"HTTP_ENGINE={engine}"]:
+                command += ["-s", item]
+            output = subprocess.run(command, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            server_stats = json.loads(urlopen(f"{base_url}/__stats__").read())
+        finally:
+            server.terminate()
+            server.wait()
+        permits = server_stats["permits"] or 1
+        print(
+            f"{engine:>7} {concurrency:>11} {server_stats['permits']:>7} {result['items'] / result['elapsed']:>9.2f} "
+            f"{server_stats['requests'] / permits:>10.2f} {result['cpu'] * 1000 / (server_stats['requests'] or 1):>10.3f} "
+            f"{result['p50'] * 1000:>7.1f} {result['p95'] * 1000:>7.1f} {result['errors']:>6} {result['limit']:>5.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Memory benchmark: peak RSS of a crawl per 1,000 permit flows in flight, against the local replay server.
+
+    python -m benchmarks.bench_memory CASSETTE_DIR [--permits permits.json] [--latency 200] [--concurrency 100 400]
+
+For each concurrency level (sessions, all of them busy at once) the replay server and the crawl
+run as separate processes. The crawl reports its RSS before crawling, its peak RSS, the most
+permit flows it had on a session at once (in flight) and the most permits admitted past
+`start()`, waiting ones included; the growth over the baseline is scaled to 1,000 flows in
+flight. Server latency keeps flows waiting on responses, so they overlap like on a slow county
+server. Pass `-s HTTP_ENGINE=asyncio` or `-s PERMITS_MAX_PENDING=N` to compare settings.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+from typing import Dict
+from urllib.request import urlopen
+
+from benchmarks.bench_e2e import ROOT, free_port, wait_for
+
+
+def current_rss_kb() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def crawl(base_url: str, permits: str, concurrency: int, extra_settings: Dict) -> None:
+    """
+    Runs one crawl in this process and prints its measurements as a JSON line.
+    """
+    from scrapy.crawler import CrawlerProcess
+
+    from spider import SETTINGS, Marionfl
+
+    in_flight = peak = admitted = peak_admitted = 0
+
+    class CountedMarionfl(Marionfl):
+        async def scrape_permit(self, permit):
+            nonlocal admitted, peak_admitted
+            admitted += 1
+            peak_admitted = max(peak_admitted, admitted)
+            try:
+                return await super().scrape_permit(permit)
+            finally:
+                admitted -= 1
+
+        async def permit_flow(self, *args, **kwargs):
+            # counted while the flow holds a session, not while it waits for one
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                return await super().permit_flow(*args, **kwargs)
+            finally:
+                in_flight -= 1
+
+    settings = {
+        **SETTINGS, "LOG_LEVEL": "WARNING", "FEEDS": {}, "LEDGER_PATH": None, "PERMIT_CACHE_PATH": None,
+        "CONCURRENT_REQUESTS": concurrency, "CONCURRENT_REQUESTS_PER_DOMAIN": concurrency, "SESSION_POOL_SIZE": concurrency,
+        "FLOW_CONTROL_ENABLED": False, "MARIONFL_BASE_URL": base_url, **extra_settings,
+    }
+    process = CrawlerProcess(settings=settings)
+    crawler = process.create_crawler(CountedMarionfl)
+    process.crawl(crawler, permits=permits, limit=sys.maxsize)
+    baseline = current_rss_kb()
+    process.start()
+    stats = crawler.stats.get_stats()
+    print(json.dumps(dict(
+        baseline=baseline,
+        peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        in_flight=peak,
+        admitted=peak_admitted,
+        items=stats.get("item_scraped_count", 0),
+        errors=stats.get("log_count/ERROR", 0),
+    )))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cassettes")
+    parser.add_argument("--permits", default=str(ROOT / "permits.json"))
+    parser.add_argument("--latency", type=float, default=200, help="server delay per response, ms")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[100])
+    parser.add_argument("-s", "--set", action="append", default=[], metavar="NAME=VALUE", help="extra Scrapy setting for the crawl")
+    parser.add_argument("--_crawl", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._crawl:
+        base_url, concurrency = args._crawl.rsplit(" ", 1)
+        crawl(base_url, args.permits, int(concurrency), dict(item.split("=", 1) for item in args.set))
+        return
+
+    print(f"{'concurrency':>11} {'permits':>7} {'admitted':>8} {'in flight':>9} {'base MB':>7} {'peak MB':>7} {'MB/1k flows':>11} {'errors':>6}")
+    for concurrency in args.concurrency:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, str(ROOT / "replay_server.py"), args.cassettes, "--port", str(port), "--latency", str(args.latency)],
+            cwd=ROOT, stderr=subprocess.DEVNULL,
+        )
+        try:
+            base_url = f"http://127.0.0.1:{port}/webpermits.dll"
+            wait_for(f"{base_url}/__stats__")
+            command = [sys.executable, "-m", "benchmarks.bench_memory", args.cassettes, "--permits", args.permits, "--_crawl", f"{base_url} {concurrency}"]
+            for item in args.set:
+                command += ["-s", item]
+            output = subprocess.run(command, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            server_stats = json.loads(urlopen(f"{base_url}/__stats__").read())
+        finally:
+            server.terminate()
+            server.wait()
+        growth = (result["peak_rss"] - result["baseline"]) / 1024
+        print(
+            f"{concurrency:>11} {server_stats['permits']:>7} {result['admitted']:>8} {result['in_flight']:>9} {result['baseline'] / 1024:>7.1f} "
+            f"{result['peak_rss'] / 1024:>7.1f} {growth * 1000 / (result['in_flight'] or 1):>11.1f} {result['errors']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
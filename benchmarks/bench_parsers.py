@@ -0,0 +1,121 @@
+"""
+Benchmark suite: precompiled single-pass parsers (`parsers.py`) vs. the original per-field XPath parsers.
+
+    python -m benchmarks.bench_parsers PAGES_DIR
+
+PAGES_DIR is searched recursively for recorded iframe pages named `*-<tab>.html`,
+where tab is one of detail, inspection, review, permit_holds, fees, subs or cos.
+A cassette directory (see `cassette.py`) already uses that naming.
+Every page is parsed by both implementations and the JSON-serialized outputs must be identical.
+"""
+import argparse
+import json
+from pathlib import Path
+import re
+import timeit
+from typing import Dict, List
+
+from scrapy.http import HtmlResponse
+
+from parsers import parse_detail, parse_grid, parse_tabs_status
+
+
+URL = "https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll"
+TABS = ("detail", "inspection", "review", "permit_holds", "fees", "subs", "cos")
+
+
+def legacy_parse_detail_tab(response) -> Dict:
+    item = dict(
+        permit_status=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT2']/@value").get(),
+        type=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT12']/@value").get('') + ', ' + response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT3']/@value").get(''),
+        owner=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT4']/@value").get(),
+        address=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT5']/@value").get(),
+        parcel=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT14']/@value").get(),
+        dba=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT6']/@value").get(),
+        job_desc=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBMEMO1'] | //input[@id='BTNPRINTJOBCARD']/parent::form/textarea/text()").get(),
+        apply_date=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT13']/@value").get(),
+        issued_date=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT8']/@value").get(),
+        co_date=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT7']/@value").get(),
+        expiration_date=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT9']/@value").get(),
+        last_inspection_request=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT10']/@value").get(),
+        last_inspection_result=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT11']/@value").get(),
+    )
+    return {k:v.strip() if isinstance(v, str) else v for k,v in item.items()}
+
+
+def legacy_parse_tab(response) -> List[Dict]:
+    headers = response.xpath("//td[@onclick]//table[contains(@id,'GRID_')]/tr[1]/td//b/span/text()").getall()
+    item = []
+    for row in response.xpath("//td[@onclick]//table[contains(@id,'GRID_')]/tr")[1:]:
+        row_item = {}
+        for header, value in zip(headers, row.xpath("./td//div/text()").getall()):
+            if value.strip():
+                row_item[header] = value
+        if row_item:
+            row_item = {k:v.strip() if isinstance(v, str) else v for k,v in row_item.items()}
+            item.append(row_item)
+    return item
+
+
+def legacy_get_tabs_status(response) -> Dict:
+    statuses = re.findall(r"\.attr\('data-badge','(\d+)'\)", response.xpath("//script[@nonce][2]").get(''))
+    if statuses and len(statuses) == 6:
+        return {
+            "review": int(statuses[0] or 0),
+            "fees": int(statuses[1] or 0),
+            "inspection": int(statuses[2] or 0),
+            "subs": int(statuses[3] or 0),
+            "cos": int(statuses[4] or 0),
+            "permit_hold": int(statuses[5] or 0),
+        }
+    return {}
+
+
+IMPLEMENTATIONS = {
+    "legacy": (lambda r: (legacy_parse_detail_tab(r), legacy_get_tabs_status(r)), legacy_parse_tab),
+    "compiled": (lambda r: (parse_detail(r), parse_tabs_status(r)), parse_grid),
+}
+
+
+def load_pages(root: Path) -> Dict[str, List[bytes]]:
+    pages = {}
+    for tab in TABS:
+        bodies = [f.read_bytes() for f in sorted(root.rglob(f"*-{tab}.html"))]
+        if bodies:
+            pages[tab] = bodies
+    return pages
+
+
+def run(func, bodies: List[bytes]) -> list:
+    # a fresh response per call, parsing the document is part of what the spider pays
+    return [func(HtmlResponse(URL, body=body, encoding="utf-8")) for body in bodies]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", type=Path)
+    parser.add_argument("-n", "--number", type=int, default=50, help="passes over each tab's pages")
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages)
+    if not pages:
+        parser.error(f"no *-<tab>.html pages under {args.pages}")
+
+    failed = False
+    print(f"{'tab':>13} {'pages':>5} {'legacy us':>10} {'compiled us':>12} {'speedup':>8}")
+    for tab, bodies in pages.items():
+        index = 0 if tab == "detail" else 1
+        outputs = {name: json.dumps(run(funcs[index], bodies)) for name, funcs in IMPLEMENTATIONS.items()}
+        if outputs["legacy"] != outputs["compiled"]:
+            failed = True
+            print(f"{tab}: OUTPUT MISMATCH")
+        timings = {}
+        for name, funcs in IMPLEMENTATIONS.items():
+            seconds = min(timeit.repeat(lambda: run(funcs[index], bodies), number=args.number, repeat=3))
+            timings[name] = seconds / (args.number * len(bodies)) * 1e6
+        print(f"{tab:>13} {len(bodies):>5} {timings['legacy']:>10.1f} {timings['compiled']:>12.1f} {timings['legacy'] / timings['compiled']:>7.1f}x")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Repeated-run check against the local replay server: the same permits crawled several times in a
+row with the default settings, ledger and permit cache included, as a nightly refresh would.
+
+    python -m benchmarks.bench_rerun CASSETTE_DIR [--permits permits.json] [--runs 2]
+
+Every run starts in the same scratch directory, so `ledger.sqlite`, `cache.sqlite` and the feed
+carry over between runs. Reports per run the items written, permit cache hits, ledger skips and
+server requests. After a full first run, later runs should emit every item again from the cache
+with (almost) no server requests.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from urllib.request import urlopen
+
+from benchmarks.bench_e2e import ROOT, free_port, wait_for
+
+
+def crawl(base_url: str, permits: str, spider_kwargs: dict) -> None:
+    """
+    Runs one crawl in this process with the default settings and prints its stats as a JSON line.
+    """
+    from spider import run
+
+    stats = run({"MARIONFL_BASE_URL": base_url, "LOG_LEVEL": "WARNING"}, permits=permits, **spider_kwargs)
+    print(json.dumps(stats, default=str))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cassettes")
+    parser.add_argument("--permits", default=str(ROOT / "permits.json"))
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("-a", "--arg", action="append", default=[], metavar="NAME=VALUE", help="spider argument for the runs after the first")
+    parser.add_argument("--_crawl", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._crawl:
+        crawl(args._crawl, args.permits, dict(item.split("=", 1) for item in args.arg))
+        return
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, str(ROOT / "replay_server.py"), args.cassettes, "--port", str(port)],
+        cwd=ROOT, stderr=subprocess.DEVNULL,
+    )
+    print(f"{'run':>3} {'items':>6} {'cache hits':>10} {'ledger skips':>12} {'requests':>8} {'errors':>6}")
+    try:
+        base_url = f"http://127.0.0.1:{port}/webpermits.dll"
+        wait_for(f"{base_url}/__stats__")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")])))
+        requests = 0
+        with tempfile.TemporaryDirectory() as workdir:
+            for run in range(1, args.runs + 1):
+                command = [sys.executable, "-m", "benchmarks.bench_rerun", args.cassettes, "--permits", os.path.abspath(args.permits), "--_crawl", base_url]
+                if run > 1:
+                    for item in args.arg:
+                        command += ["-a", item]
+                output = subprocess.run(command, cwd=workdir, env=env, check=True, capture_output=True, text=True).stdout
+                stats = json.loads(output.strip().splitlines()[-1])
+                total = json.loads(urlopen(f"{base_url}/__stats__").read())["requests"]
+                print(
+                    f"{run:>3} {stats.get('item_scraped_count', 0):>6} {stats.get('cache/hits', 0):>10} "
+                    f"{stats.get('ledger/skipped', 0):>12} {total - requests:>8} {stats.get('log_count/ERROR', 0):>6}"
+                )
+                requests = total
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
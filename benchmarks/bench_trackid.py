@@ -0,0 +1,56 @@
+"""
+Micro-benchmark: trackid extraction from raw bytes vs. the old XPath + `//*` regex fallback.
+
+    python -m benchmarks.bench_trackid CAPTURE [CAPTURE ...]
+
+Each CAPTURE is a response body file or a directory searched recursively for `*.html`.
+"""
+import argparse
+from pathlib import Path
+import timeit
+from typing import List
+
+from scrapy.http import HtmlResponse
+
+from intraweb import extract_trackid
+
+
+URL = "https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll"
+
+
+def xpath_trackid(body: bytes) -> str:
+    response = HtmlResponse(URL, body=body, encoding="utf-8")
+    return response.xpath("//trackid/text()").get() or response.xpath("//*").re_first(r'"IW_TrackID_": (\d+)')
+
+
+def load_bodies(paths: List[str]) -> List[bytes]:
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.rglob("*.html")) if path.is_dir() else [path])
+    return [f.read_bytes() for f in files]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+")
+    parser.add_argument("-n", "--number", type=int, default=200, help="passes over all captures")
+    args = parser.parse_args()
+
+    bodies = load_bodies(args.captures)
+    if not bodies:
+        parser.error("no captured responses found")
+    mismatches = sum(xpath_trackid(b) != extract_trackid(b) for b in bodies)
+
+    results = {}
+    for name, func in (("xpath", xpath_trackid), ("bytes", extract_trackid)):
+        seconds = min(timeit.repeat(lambda: [func(b) for b in bodies], number=args.number, repeat=3))
+        results[name] = seconds / (args.number * len(bodies))
+
+    print(f"{len(bodies)} responses, {sum(map(len, bodies)) / len(bodies) / 1024:.1f} KiB avg, {mismatches} mismatches")
+    for name, per_call in results.items():
+        print(f"{name:>6}: {per_call * 1e6:9.1f} us/response")
+    print(f"speedup: {results['xpath'] / results['bytes']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
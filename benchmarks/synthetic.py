@@ -0,0 +1,142 @@
+"""
+Builds synthetic cassettes from a scraped feed, for offline runs when no recorded cassettes are at hand.
+
+    python -m benchmarks.synthetic sample.json cassettes/synthetic [--page-kb 40]
+
+Each item becomes one session cassette that walks the same steps the spider does. The HTML
+is minimal IntraWeb markup that parses back to the item, padded with an inline script to a
+realistic page size. Useful for throughput, request-count and parser benchmarks; real cassettes
+from `CASSETTE_RECORD_DIR` remain the reference for anything touching server behaviour.
+"""
+import argparse
+import html
+import json
+from pathlib import Path
+from typing import Dict, List
+
+
+GRID_TABS = (
+    # tab, item key, badge position, button, form name
+    ("inspection", "inspection", 2, "BTNVIEWINSPECTIONS", "FrmPermitInspections"),
+    ("review", "reviews", 0, "BTNVIEWPLANREVIEWS", "FrmPlanReviews"),
+    ("permit_holds", "permit_holds", 5, "BTNPERMITHOLDS", "FrmComments"),
+    ("fees", "fees", 1, "BTNVIEWFEES", "FrmFees"),
+    ("subs", "subs", 3, "BTNSUBS", "FrmSubContractors"),
+    ("cos", "cos", 4, "BTNVIEWCOS", "FrmCertOcc"),
+)
+DETAIL_INPUTS = dict(
+    permit_status="IWDBEDIT2", owner="IWDBEDIT4", address="IWDBEDIT5", parcel="IWDBEDIT14", dba="IWDBEDIT6",
+    apply_date="IWDBEDIT13", issued_date="IWDBEDIT8", co_date="IWDBEDIT7", expiration_date="IWDBEDIT9",
+    last_inspection_request="IWDBEDIT10", last_inspection_result="IWDBEDIT11",
+)
+
+
+def padding(page_kb: int) -> str:
+    return "<script>var IW_PAD = '" + "x" * (page_kb * 1024) + "';</script>"
+
+
+def escape(text: str) -> str:
+    return html.escape(text).replace("\r", "&#13;")
+
+
+def value_attr(value: str) -> str:
+    return "" if value is None else f' value="{escape(value)}"'
+
+
+def ajax(trackid: int) -> bytes:
+    return f'<?xml version="1.0" encoding="UTF-8"?><response><trackid>{trackid}</trackid><execute>IW.update();</execute></response>'.encode()
+
+
+def landing_page(session_id: str, page_kb: int) -> bytes:
+    return (
+        f'<html><head>{padding(page_kb)}<script>var GTrack = {{"IW_TrackID_": 1}};</script></head><body><form name="SubmitForm">'
+        f'<input type="hidden" name="IW_SessionID_" value="{session_id}"><input type="hidden" name="IW_WindowID_" value="I1">'
+        f'</form></body></html>'
+    ).encode()
+
+
+def detail_page(item: Dict, trackid: int, page_kb: int) -> bytes:
+    detail = item["detail"]
+    type_code, _, type_desc = (detail["type"] or "").partition(", ")
+    inputs = "".join(f'<input type="text" id="{input_id}"{value_attr(detail[key])}>' for key, input_id in DETAIL_INPUTS.items())
+    inputs += f'<input type="text" id="IWDBEDIT12" value="{html.escape(type_code)}"><input type="text" id="IWDBEDIT3" value="{html.escape(type_desc)}">'
+    badges = [0] * 6
+    for _, key, position, _, _ in GRID_TABS:
+        badges[position] = len(item[key])
+    badge_js = "".join(f"$('#B{i}').attr('data-badge','{count}');" for i, count in enumerate(badges))
+    return (
+        f'<html><head><script nonce="n1">var GTrack = {{"IW_TrackID_": {trackid}}};</script><script nonce="n2">{badge_js}</script>{padding(page_kb)}</head>'
+        f'<body><form id="FrmPermitDetail"><input type="button" id="BTNPRINTJOBCARD">{inputs}'
+        f'<textarea id="IWDBMEMO1">{escape(detail["job_desc"] or "")}</textarea></form></body></html>'
+    ).encode()
+
+
+def grid_page(rows: List[Dict], trackid: int, page_kb: int) -> bytes:
+    headers = list(dict.fromkeys(header for row in rows for header in row))
+    head = "<tr>" + "".join(f"<td><b><span>{html.escape(h)}</span></b></td>" for h in headers) + "</tr>"
+    body = "".join("<tr>" + "".join(f"<td><div> {html.escape(row.get(h, ''))} </div></td>" for h in headers) + "</tr>" for row in rows)
+    return (
+        f'<html><head><script>var GTrack = {{"IW_TrackID_": {trackid}}};</script>{padding(page_kb)}</head>'
+        f'<body><table><tr><td onclick="IW.select()"><table id="GRID_1">{head}{body}</table></td></tr></table></body></html>'
+    ).encode()
+
+
+def callback(name: str, formname: str = None, **form) -> Dict:
+    if formname:
+        form["IW_FormName"] = formname
+    return dict(method="POST", path="/{session}/$/callback", query={"callback": name}, form=form)
+
+
+def page(trackid: int) -> Dict:
+    return dict(method="POST", path="/{session}/", query={}, form={"IW_TrackID_": str(trackid)})
+
+
+def write_cassette(root: Path, index: int, item: Dict, page_kb: int) -> None:
+    session_id = f"SYNTH{index:06d}"
+    exchanges = [
+        ("landing", dict(method="GET", path="", query={}, form={}), landing_page(session_id, page_kb)),
+        ("register_session", page(1), ajax(1)),
+        ("set_timer", dict(method="GET", path="/{session}/$/callback", query={"callback": "TIMERLOAD.DoOnAsyncTimer", "IW_FormName": "FrmStart", "IW_TrackID_": "1"}, form={}), ajax(2)),
+        ("click_permit_btn", callback("BTNPERMITS.DoOnAsyncClick", "FrmStart", IW_TrackID_="2"), ajax(3)),
+        ("set_trackid", page(3), ajax(4)),
+        ("set_timer", dict(method="GET", path="/{session}/$/callback", query={"callback": "TIMERLOAD.DoOnAsyncTimer", "IW_FormName": "FrmMain", "IW_TrackID_": "1"}, form={}), ajax(5)),
+        ("submit_permit", callback("EDTPERMITNBR.DoOnAsyncKeyUp", "FrmMain", EDTPERMITNBR=item["permit"], IW_TrackID_="5"), ajax(6)),
+        ("detail_click", callback("BTNGUESTLOGIN.DoOnAsyncClick", "FrmMain", EDTPERMITNBR=item["permit"], IW_TrackID_="6"), ajax(7)),
+        ("detail", page(7), detail_page(item, 7, page_kb)),
+    ]
+    trackid = 7
+    for tab, key, _, button, formname in GRID_TABS:
+        if not item[key]:
+            continue
+        exchanges.append((f"{tab}_click", callback(f"{button}.DoOnAsyncClick", "FrmPermitDetail", IW_TrackID_=str(trackid)), ajax(trackid + 1)))
+        exchanges.append((tab, page(trackid + 1), grid_page(item[key], trackid + 1, page_kb)))
+        exchanges.append((f"{tab}_back", callback("IMGBACK.DoOnAsyncClick", formname, IW_TrackID_=str(trackid + 1)), ajax(trackid + 2)))
+        trackid += 2
+    exchanges.append(("detail_back", callback("IMGBACK.DoOnAsyncClick", "FrmPermitDetail", IW_TrackID_=str(trackid)), ajax(trackid + 1)))
+
+    cassette = root / session_id
+    cassette.mkdir(parents=True, exist_ok=True)
+    with open(cassette / "exchanges.jsonl", "w") as f:
+        for seq, (step, request, body) in enumerate(exchanges, start=1):
+            body_name = f"{seq:04d}-{step}.html"
+            (cassette / body_name).write_bytes(body)
+            content_type = "text/xml" if body.startswith(b"<?xml") else "text/html"
+            f.write(json.dumps(dict(seq=seq, step=step, session_id=session_id, status=200, content_type=content_type, latency=None, body=body_name, **request)) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("feed", type=Path, help="JSON array of scraped items, e.g. sample.json")
+    parser.add_argument("out", type=Path)
+    parser.add_argument("--page-kb", type=int, default=40, help="pad every page to roughly this size")
+    args = parser.parse_args()
+
+    with open(args.feed, "r") as f:
+        items = json.load(f)
+    for index, item in enumerate(items):
+        write_cassette(args.out, index, item, args.page_kb)
+    print(f"Wrote {len(items)} synthetic cassettes to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Cassettes: recorded IntraWeb exchanges, one directory per session.
+
+    <cassette dir>/<session id>/exchanges.jsonl   one JSON line per request/response
+    <cassette dir>/<session id>/0007-detail.html  response body, named after the spider step
+
+Recording is done by `CassetteRecorderMiddleware` (enabled by the `CASSETTE_RECORD_DIR` setting),
+replaying by `replay_server.py`. Both walk the exchanges through `ReplayState` so a response
+is looked up by what the client did, not by session id or trackid.
+"""
+from dataclasses import dataclass
+import json
+from pathlib import Path
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from scrapy.exceptions import NotConfigured
+
+from intraweb import extract_session_state
+
+
+
+@dataclass
+class ReplayState:
+    """
+    What an IntraWeb session is showing: the permit last typed in and the last ajax callback.
+    Plain page fetches (no `callback` query) return whatever that callback opened.
+    """
+    permit: Optional[str] = None
+    last_callback: Optional[str] = None
+
+    def key(self, method: str, query: Dict[str, str], form: Dict[str, str]) -> Tuple[Tuple, Optional[str]]:
+        """
+        Returns `(key, permit)` for a request and advances the state past it.
+        """
+        callback = query.get("callback")
+        action = callback if callback else "page:" + (self.last_callback or "")
+        formname = form.get("IW_FormName") or query.get("IW_FormName")
+        if "EDTPERMITNBR" in form:
+            self.permit = form["EDTPERMITNBR"]
+        if callback:
+            self.last_callback = callback
+        return (method, action, formname), self.permit
+
+
+
+def split_target(target: str) -> Tuple[str, Dict[str, str]]:
+    parts = urlsplit(target)
+    return parts.path, dict(parse_qsl(parts.query, keep_blank_values=True))
+
+
+def parse_form(body: bytes) -> Dict[str, str]:
+    return dict(parse_qsl(body.decode("latin-1"), keep_blank_values=True)) if body else {}
+
+
+def read_cassette(path: Path) -> Iterator[Tuple[Dict, bytes]]:
+    """
+    Yields `(exchange, body)` for every recorded exchange in order.
+    """
+    with open(path / "exchanges.jsonl", "r") as f:
+        for line in f:
+            exchange = json.loads(line)
+            yield exchange, (path / exchange["body"]).read_bytes()
+
+
+def find_cassettes(root: Path) -> List[Path]:
+    return sorted(p.parent for p in Path(root).rglob("exchanges.jsonl"))
+
+
+
+class CassetteRecorderMiddleware:
+    """
+    Downloader middleware that saves every session-chain exchange into cassette files.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.seq: Dict[str, int] = {}
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        root = crawler.settings.get("CASSETTE_RECORD_DIR")
+        if not root:
+            raise NotConfigured
+        return cls(root)
+
+
+    def process_response(self, request, response, spider):
+        step = request.meta.get("step")
+        if step is None:
+            return response
+        relative = request.url[len(spider.base_url):]
+        path, query = split_target(relative)
+        session_id = path.strip("/").split("/")[0] if path.strip("/") else extract_session_state(response.body)[0]
+        if not session_id:
+            return response
+
+        seq = self.seq[session_id] = self.seq.get(session_id, 0) + 1
+        cassette = self.root / session_id
+        cassette.mkdir(exist_ok=True)
+        body_name = f"{seq:04d}-{step}.html"
+        (cassette / body_name).write_bytes(response.body)
+        exchange = dict(
+            seq=seq,
+            step=step,
+            session_id=session_id,
+            method=request.method,
+            path=path,
+            query=query,
+            form=parse_form(request.body),
+            status=response.status,
+            content_type=response.headers.get("Content-Type", b"text/html").decode("latin-1"),
+            latency=request.meta.get("download_latency"),
+            recorded_at=time.time(),
+            body=body_name,
+        )
+        with open(cassette / "exchanges.jsonl", "a") as f:
+            f.write(json.dumps(exchange) + "\n")
+        return response
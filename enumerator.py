@@ -0,0 +1,162 @@
+"""
+Discovers which permit ids exist by probing the permit number box, without opening any permit.
+
+    python enumerator.py
+
+Permit ids are `YYYYMMNNNN`. For every month, one warm pooled session fires `EDTPERMITNBR` keyups
+back to back: a galloping then bisecting search finds the last sequence number in use, and every
+number up to it is probed once. The existing ids are yielded as `{"permit": ...}` items, which
+`permit_source` reads back as crawl input. Spider arguments: `months` (`202201-202312` or
+`202201,202205`, by default the months seen in `permits`), `gap` (longest run of missing numbers
+still treated as a hole rather than the end of the month) and `shard` (`i/N` over months).
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterator, List
+
+import scrapy
+from scrapy.http import Response
+
+from permit_source import in_shard, iter_permits, parse_shard
+from spider import Marionfl, SessionExpired, run
+
+
+MAX_SEQUENCE = 9999
+
+
+async def last_sequence(exists: Callable[[int], Awaitable[bool]], gap: int = 10, start: int = 1, ceiling: int = MAX_SEQUENCE) -> int:
+    """
+    Highest sequence number for which `exists` holds, 0 for an empty month. A run of `gap`
+    misses is taken as the end of the month, so shorter holes are stepped over. `start` is a
+    sequence number believed to exist, the gallop begins there.
+    """
+    async def alive(n: int) -> bool:
+        for seq in range(n, min(n + gap, ceiling + 1)):
+            if await exists(seq):
+                return True
+        return False
+
+    if not await alive(1):
+        return 0
+    lo, hi = 1, max(2, start)
+    while hi <= ceiling and await alive(hi):
+        lo, hi = hi, hi * 2
+    hi = min(hi, ceiling + 1)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if await alive(mid):
+            lo = mid
+        else:
+            hi = mid
+    last = lo
+    for seq in range(lo, min(lo + gap, ceiling + 1)):
+        if await exists(seq):
+            last = seq
+    return last
+
+
+def iter_months(spec: str) -> Iterator[str]:
+    """
+    Expands `202201-202203,202210` into `YYYYMM` strings.
+    """
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        year, month = int(first[:4]), int(first[4:6])
+        last = last or first
+        while f"{year:04d}{month:02d}" <= last:
+            yield f"{year:04d}{month:02d}"
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+
+class PermitEnumerator(Marionfl):
+    name = "marionfl_enumerator"
+    months = None
+    gap = 10
+    custom_settings = {
+        "LEDGER_PATH": None,
+        "PERMIT_CACHE_PATH": None,
+        "FEEDS": {"permits.jsonl": {"format": "jsonlines"}},
+    }
+
+
+    async def start(self):
+        index, count = parse_shard(self.shard)
+        seeds = self.seed_sequences()
+        months = iter_months(self.months) if self.months else sorted(seeds)
+        for month in months:
+            if not in_shard(month, index, count):
+                continue
+            yield scrapy.Request("data:,", callback=self.parse, cb_kwargs={"month": month, "start": seeds.get(month, 1)}, dont_filter=True)
+
+
+    def seed_sequences(self) -> Dict[str, int]:
+        """
+        Highest sequence number per month in the `permits` input, where the gallop starts.
+        """
+        seeds = {}
+        for permit in iter_permits(self.permits, run_size=self.settings.getint("PERMITS_DEDUPE_RUN_SIZE", 1_000_000)):
+            if len(permit) == 10 and permit.isdigit():
+                month, seq = permit[:6], int(permit[6:])
+                seeds[month] = max(seeds.get(month, 1), seq)
+        return seeds
+
+
+    async def parse(self, response: Response, month: str, start: int = 1):
+        for permit in await self.enumerate_month(month, start):
+            yield {"permit": permit}
+
+
+    async def enumerate_month(self, month: str, start: int = 1) -> List[str]:
+        gap = int(self.gap)
+        found: Dict[int, bool] = {}
+        session = await self.session_pool.acquire()
+
+        async def exists(seq: int) -> bool:
+            # keys one permit number into FrmMain, swapping a lost session for a pooled one
+            nonlocal session
+            if seq in found:
+                return found[seq]
+            permit = f"{month}{seq:04d}"
+            recoveries = 0
+            while True:
+                try:
+                    found[seq], trackid = await self.submit_permit(session, self.get_ajax_id(), permit)
+                    if trackid is None:
+                        # answered, but the session cannot take another keyup without a trackid
+                        await self.session_pool.discard(session)
+                        session = None
+                        session = await self.session_pool.acquire()
+                    else:
+                        session.trackid = trackid
+                    break
+                except SessionExpired as e:
+                    await self.session_pool.discard(session)
+                    session = None
+                    self.metrics.inc("sessions/expired")
+                    if recoveries >= self.session_recoveries:
+                        raise
+                    recoveries += 1
+                    self.metrics.inc("sessions/recovered")
+                    self.logger.debug(f"Session {e} lost while probing {permit}, retrying on a new one")
+                    await asyncio.sleep(self.backoff(recoveries))
+                    session = await self.session_pool.acquire()
+            self.metrics.inc("enumerate/hits" if found[seq] else "enumerate/misses")
+            return found[seq]
+
+        try:
+            last = await last_sequence(exists, gap=gap, start=start)
+            permits = [f"{month}{seq:04d}" for seq in range(1, last + 1) if await exists(seq)]
+        except BaseException:
+            if session is not None:
+                await self.session_pool.discard(session)
+            raise
+        await self.park_session(session, session.trackid)
+        self.metrics.inc("enumerate/months")
+        if not permits:
+            self.metrics.inc("enumerate/empty_months")
+        self.logger.info(f"{month}: {len(permits)} permits up to {last}, {len(found)} probes")
+        return permits
+
+
+if __name__ == "__main__":
+    run(spider_cls=PermitEnumerator)
@@ -0,0 +1,75 @@
+import asyncio
+
+
+
+class FlowController:
+    """
+    Caps how many permit flows run at once, AIMD style. Every flow that completes cleanly adds
+    `1 / limit` (about one flow per round of flows); a step failure, a lost session or smoothed
+    step latency above `latency_factor` times its baseline halves it, at most once per round.
+    The limit stays within `minimum` and `maximum`, the hard ceiling on concurrent sessions.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 16, backoff: float = 0.5, latency_factor: float = 2.0, smoothing: float = 0.02):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.smoothing = smoothing
+        self.latency = None
+        self.base_latency = None
+        self.active = 0
+        self.completed = 0
+        self.decreases = 0
+        self.peak = self.limit
+        self._recover_at = 0
+        self._cond = asyncio.Condition()
+
+
+    async def __aenter__(self) -> "FlowController":
+        async with self._cond:
+            while self.active >= int(self.limit):
+                await self._cond.wait()
+            self.active += 1
+        return self
+
+
+    async def __aexit__(self, *exc_info) -> None:
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+
+    def observe_latency(self, seconds: float) -> None:
+        if self.latency is None:
+            self.latency = self.base_latency = seconds
+            return
+        self.latency += self.smoothing * (seconds - self.latency)
+        if self.limit <= self.minimum:
+            # nothing left to back off, so this is how fast the server is now
+            self.base_latency = self.latency
+        else:
+            self.base_latency = min(self.base_latency, self.latency)
+
+
+    def success(self) -> None:
+        self.completed += 1
+        if self.latency is not None and self.latency > self.latency_factor * self.base_latency:
+            self.decrease()
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.peak = max(self.peak, self.limit)
+
+
+    def failure(self) -> None:
+        self.decrease()
+
+
+    def decrease(self) -> None:
+        # flows already in flight saw the same conditions, let them drain before backing off again
+        if self.completed < self._recover_at:
+            return
+        self.limit = max(self.minimum, self.limit * self.backoff)
+        self._recover_at = self.completed + self.active
+        self.decreases += 1
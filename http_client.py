@@ -0,0 +1,157 @@
+"""
+Minimal keep-alive HTTP/1.1 client on asyncio streams, used by the spider's `HTTP_ENGINE = "asyncio"` mode.
+"""
+import asyncio
+import ssl
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+
+Address = Tuple[str, int, bool]
+
+
+class Connection:
+    __slots__ = ("reader", "writer")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+
+class HTTPClient:
+    """
+    Sends one request at a time per connection and keeps connections open between requests,
+    up to `max_idle` idle ones per host. A request that fails on a reused connection, which
+    the server may have closed meanwhile, is sent once more on a fresh one.
+    """
+
+    def __init__(self, timeout: float = 180, max_idle: int = 16):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.opened = 0
+        self._idle: Dict[Address, List[Connection]] = {}
+        self._ssl: Optional[ssl.SSLContext] = None
+
+
+    async def request(self, method: str, url: str, headers: List[Tuple[str, str]] = (), body: bytes = b"") -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """
+        Returns the status, headers and body of the response.
+        """
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        address = (parts.hostname, parts.port or (443 if secure else 80), secure)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+        lines = [f"{method} {target} HTTP/1.1"]
+        names = set()
+        for name, value in headers:
+            lines.append(f"{name}: {value}")
+            names.add(name.lower())
+        if "host" not in names:
+            lines.append(f"Host: {parts.netloc}")
+        if body or method == "POST":
+            lines.append(f"Content-Length: {len(body)}")
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        for attempt in range(2):
+            connection, reused = await self._connection(address)
+            try:
+                connection.writer.write(head + body if body else head)
+                await connection.writer.drain()
+                status, response_headers, payload, keep_alive = await asyncio.wait_for(self._read_response(connection.reader, method), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            if keep_alive:
+                self._release(address, connection)
+            else:
+                connection.close()
+            return status, response_headers, payload
+
+
+    def close(self) -> None:
+        for connections in self._idle.values():
+            for connection in connections:
+                connection.close()
+        self._idle = {}
+
+
+    async def _connection(self, address: Address) -> Tuple[Connection, bool]:
+        idle = self._idle.get(address)
+        while idle:
+            connection = idle.pop()
+            if not connection.reader.at_eof():
+                return connection, True
+            connection.close()
+        host, port, secure = address
+        if secure and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=self._ssl if secure else None), self.timeout)
+        self.opened += 1
+        return Connection(reader, writer), False
+
+
+    def _release(self, address: Address, connection: Connection) -> None:
+        idle = self._idle.setdefault(address, [])
+        if len(idle) < self.max_idle:
+            idle.append(connection)
+        else:
+            connection.close()
+
+
+    async def _read_response(self, reader: asyncio.StreamReader, method: str) -> Tuple[int, List[Tuple[str, str]], bytes, bool]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed before the response")
+        version, status = status_line.decode("latin-1").split(None, 2)[:2]
+        status = int(status)
+
+        headers = []
+        fields = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip(), value.strip()
+            headers.append((name, value))
+            fields[name.lower()] = value
+
+        keep_alive = version == "HTTP/1.1" and fields.get("connection", "").lower() != "close"
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            body = b""
+        elif "chunked" in fields.get("transfer-encoding", "").lower():
+            body = await self._read_chunked(reader)
+        elif "content-length" in fields:
+            body = await reader.readexactly(int(fields["content-length"]))
+        else:
+            # delimited by the server closing the connection
+            body = await reader.read()
+            keep_alive = False
+        return status, headers, body, keep_alive
+
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0].strip() or b"0", 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        # trailers
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        return b"".join(chunks)
@@ -0,0 +1,67 @@
+import re
+from typing import Optional, Tuple
+
+
+
+TRACKID_OPEN, TRACKID_CLOSE = b"<trackid>", b"</trackid>"
+EXECUTE_OPEN, EXECUTE_CLOSE = b"<execute>", b"</execute>"
+TRACKID_JSON = re.compile(rb'"IW_TrackID_":\s*(\d+)')
+VALUE_ATTR = re.compile(rb"""\svalue\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.I)
+
+
+def extract_trackid(body: bytes) -> Optional[str]:
+    """
+    Reads the IntraWeb trackid straight from the raw response bytes.
+    Ajax callbacks carry it as `<trackid>N</trackid>`, full pages as `"IW_TrackID_": N`.
+    """
+    start = body.find(TRACKID_OPEN)
+    if start != -1:
+        start += len(TRACKID_OPEN)
+        end = body.find(TRACKID_CLOSE, start)
+        if end != -1:
+            return body[start:end].strip().decode() or None
+    match = TRACKID_JSON.search(body)
+    return match.group(1).decode() if match else None
+
+
+def extract_script(body: bytes) -> bytes:
+    """
+    Returns the script an ajax callback runs, its `<execute>` elements joined, b"" for other responses.
+    """
+    parts = []
+    end = 0
+    while True:
+        start = body.find(EXECUTE_OPEN, end)
+        if start == -1:
+            return b"\n".join(parts)
+        start += len(EXECUTE_OPEN)
+        end = body.find(EXECUTE_CLOSE, start)
+        if end == -1:
+            return b"\n".join(parts)
+        parts.append(body[start:end])
+
+
+def extract_input_value(body: bytes, name: str) -> Optional[str]:
+    """
+    Returns the value of the first `<input name=...>` without parsing the document.
+    """
+    for quote in (b'"', b"'"):
+        at = body.find(b"name=" + quote + name.encode() + quote)
+        if at != -1:
+            break
+    else:
+        return None
+    tag_start, tag_end = body.rfind(b"<", 0, at), body.find(b">", at)
+    if tag_start == -1 or tag_end == -1:
+        return None
+    match = VALUE_ATTR.search(body, tag_start, tag_end)
+    if match is None:
+        return None
+    return next(group for group in match.groups() if group is not None).decode()
+
+
+def extract_session_state(body: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns `(IW_SessionID_, IW_WindowID_)` from the landing page.
+    """
+    return extract_input_value(body, "IW_SessionID_"), extract_input_value(body, "IW_WindowID_")
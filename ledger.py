@@ -0,0 +1,89 @@
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+
+SCRAPED, NONEXISTENT, FAILED = "scraped", "nonexistent", "failed"
+FINISHED = (SCRAPED, NONEXISTENT)
+
+
+class PermitLedger:
+    """
+    On-disk record of each permit's outcome, so a restarted crawl skips finished permits.
+    It covers one run: the spider clears the finished permits when a crawl finishes cleanly and
+    keeps the failed ones, whose attempts add up until a later run gets them through.
+    Outcomes are buffered and committed in batches to keep writes cheap at high throughput.
+    """
+
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS permits ("
+            "permit TEXT PRIMARY KEY, status TEXT NOT NULL, attempts INTEGER NOT NULL, updated_at REAL NOT NULL, error TEXT"
+            ") WITHOUT ROWID"
+        )
+        self.conn.commit()
+        self._pending: Dict[str, Tuple[str, float, Optional[str]]] = {}
+        self._last_flush = time.monotonic()
+
+
+    def record(self, permit: str, status: str, error: str = None) -> None:
+        self._pending[permit] = (status, time.time(), error)
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+
+    def status(self, permit: str) -> Optional[str]:
+        if permit in self._pending:
+            return self._pending[permit][0]
+        row = self.conn.execute("SELECT status FROM permits WHERE permit = ?", (permit,)).fetchone()
+        return row[0] if row else None
+
+
+    def is_finished(self, permit: str) -> bool:
+        return self.status(permit) in FINISHED
+
+
+    def permits(self, status: str) -> List[str]:
+        self.flush()
+        return [row[0] for row in self.conn.execute("SELECT permit FROM permits WHERE status = ?", (status,))]
+
+
+    def counts(self) -> Dict[str, int]:
+        self.flush()
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM permits GROUP BY status").fetchall())
+
+
+    def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        rows = [(permit, status, updated_at, error) for permit, (status, updated_at, error) in self._pending.items()]
+        self._pending = {}
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO permits (permit, status, attempts, updated_at, error) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT(permit) DO UPDATE SET status = excluded.status, attempts = attempts + 1, "
+                "updated_at = excluded.updated_at, error = excluded.error",
+                rows,
+            )
+
+
+    def clear(self) -> None:
+        """
+        Forgets the finished permits, once a run is complete and there is nothing left to resume.
+        """
+        self.flush()
+        with self.conn:
+            self.conn.execute(f"DELETE FROM permits WHERE status IN ({', '.join('?' * len(FINISHED))})", FINISHED)
+
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,169 @@
+from bisect import bisect_left
+import json
+import os
+import time
+from typing import Dict, Sequence, Tuple
+
+from twisted.internet import task
+
+
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PARSE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th observation, the last bound for the overflow bucket.
+        """
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+    def cumulative(self) -> Tuple[Tuple[str, int], ...]:
+        total, buckets = 0, []
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            buckets.append((str(bound), total))
+        return tuple(buckets)
+
+
+
+class StepMetrics:
+    """
+    Latency, response size and parse time per permit-flow step, plus event counters.
+    Everything is mirrored into Scrapy's stats collector. When `METRICS_EXPORT_PATH` is set,
+    a snapshot is rewritten every `METRICS_EXPORT_INTERVAL` seconds: Prometheus textfile
+    format for `.prom` paths, JSON otherwise.
+    """
+
+    def __init__(self, crawler, path: str = None, interval: float = 30):
+        self.crawler = crawler
+        self.path = path
+        self.interval = interval
+        self.latency: Dict[str, Histogram] = {}
+        self.size: Dict[str, Histogram] = {}
+        self.parse: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self._task = None
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler,
+            path=crawler.settings.get("METRICS_EXPORT_PATH"),
+            interval=crawler.settings.getfloat("METRICS_EXPORT_INTERVAL", 30),
+        )
+
+
+    @property
+    def stats(self):
+        # newer Scrapy only creates the stats collector once the crawl starts
+        return self.crawler.stats
+
+
+    def start(self) -> None:
+        if self.path and self.interval:
+            self._task = task.LoopingCall(self.export)
+            self._task.start(self.interval, now=False)
+
+
+    def stop(self) -> None:
+        if self._task is not None and self._task.running:
+            self._task.stop()
+        for step, histogram in self.latency.items():
+            self.stats.set_value(f"steps/{step}/latency_ms_p50", round(histogram.quantile(0.5) * 1000, 1))
+            self.stats.set_value(f"steps/{step}/latency_ms_p95", round(histogram.quantile(0.95) * 1000, 1))
+        if self.path:
+            self.export()
+
+
+    def observe_request(self, step: str, seconds: float, size: int) -> None:
+        self._histogram(self.latency, step, LATENCY_BUCKETS).observe(seconds)
+        self._histogram(self.size, step, SIZE_BUCKETS).observe(size)
+        self.stats.inc_value(f"steps/{step}/count")
+        self.stats.inc_value(f"steps/{step}/latency_ms_sum", round(seconds * 1000, 3))
+        self.stats.inc_value(f"steps/{step}/bytes", size)
+
+
+    def observe_parse(self, step: str, seconds: float) -> None:
+        self._histogram(self.parse, step, PARSE_BUCKETS).observe(seconds)
+        self.stats.inc_value(f"steps/{step}/parse_ms_sum", round(seconds * 1000, 3))
+
+
+    def inc(self, name: str, count: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + count
+        self.stats.inc_value(name, count)
+
+
+    def snapshot(self) -> Dict:
+        def dump(histograms: Dict[str, Histogram]) -> Dict:
+            return {
+                step: dict(count=h.count, sum=h.sum, p50=h.quantile(0.5), p95=h.quantile(0.95), buckets=dict(h.cumulative()))
+                for step, h in histograms.items()
+            }
+        return dict(
+            time=time.time(),
+            latency_seconds=dump(self.latency),
+            response_bytes=dump(self.size),
+            parse_seconds=dump(self.parse),
+            counters=dict(self.counters),
+        )
+
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, histograms in (("latency_seconds", self.latency), ("response_bytes", self.size), ("parse_seconds", self.parse)):
+            metric = f"marionfl_step_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for step, h in sorted(histograms.items()):
+                for bound, count in h.cumulative():
+                    lines.append(f'{metric}_bucket{{step="{step}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_sum{{step="{step}"}} {h.sum}')
+                lines.append(f'{metric}_count{{step="{step}"}} {h.count}')
+        lines.append("# TYPE marionfl_events_total counter")
+        for name, count in sorted(self.counters.items()):
+            lines.append(f'marionfl_events_total{{name="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+    def export(self) -> None:
+        # write then rename, so collectors never read a half-written file
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            if self.path.endswith(".prom"):
+                f.write(self.prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=4)
+        os.replace(tmp, self.path)
+
+
+    @staticmethod
+    def _histogram(histograms: Dict[str, Histogram], step: str, bounds: Sequence[float]) -> Histogram:
+        histogram = histograms.get(step)
+        if histogram is None:
+            histogram = histograms[step] = Histogram(bounds)
+        return histogram
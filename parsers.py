@@ -0,0 +1,87 @@
+import re
+import sys
+from typing import Dict, List
+
+from lxml import etree
+from scrapy.http import Response
+
+
+
+DETAIL_FORM = etree.XPath("//input[@id='BTNPRINTJOBCARD']/parent::form")
+DETAIL_JOB_DESC = etree.XPath("input[@id='IWDBMEMO1'] | textarea/text()")
+DETAIL_FIELDS = (
+    ("permit_status", "IWDBEDIT2"),
+    ("owner", "IWDBEDIT4"),
+    ("address", "IWDBEDIT5"),
+    ("parcel", "IWDBEDIT14"),
+    ("dba", "IWDBEDIT6"),
+    ("apply_date", "IWDBEDIT13"),
+    ("issued_date", "IWDBEDIT8"),
+    ("co_date", "IWDBEDIT7"),
+    ("expiration_date", "IWDBEDIT9"),
+    ("last_inspection_request", "IWDBEDIT10"),
+    ("last_inspection_result", "IWDBEDIT11"),
+)
+DETAIL_KEYS = ("permit_status", "type", "owner", "address", "parcel", "dba", "job_desc", "apply_date", "issued_date", "co_date", "expiration_date", "last_inspection_request", "last_inspection_result")
+
+GRID_HEADERS = etree.XPath("//td[@onclick]//table[contains(@id,'GRID_')]/tr[1]/td//b/span/text()", smart_strings=False)
+GRID_ROWS = etree.XPath("//td[@onclick]//table[contains(@id,'GRID_')]/tr")
+GRID_CELLS = etree.XPath("./td//div/text()", smart_strings=False)
+
+BADGE_SCRIPT = etree.XPath("//script[@nonce][2]")
+BADGE_COUNT = re.compile(r"\.attr\('data-badge','(\d+)'\)")
+BADGE_TABS = ("review", "fees", "inspection", "subs", "cos", "permit_hold")
+
+
+def parse_detail(response: Response) -> Dict:
+    """
+    Single pass over the permit detail form: the form is located once and its inputs
+    are indexed by id, instead of one absolute XPath per field.
+    """
+    forms = DETAIL_FORM(response.selector.root)
+    values = {}
+    job_desc = None
+    for form in forms:
+        for child in form.iterchildren("input"):
+            input_id, value = child.get("id"), child.get("value")
+            if input_id is not None and value is not None:
+                values.setdefault(input_id, value)
+        if job_desc is None:
+            found = DETAIL_JOB_DESC(form)
+            if found:
+                job_desc = found[0] if isinstance(found[0], str) else etree.tostring(found[0], method="html", encoding="unicode", with_tail=False)
+
+    item = {key: values.get(input_id) for key, input_id in DETAIL_FIELDS}
+    item["type"] = (values.get("IWDBEDIT12") or '') + ', ' + (values.get("IWDBEDIT3") or '')
+    item["job_desc"] = job_desc
+    return {k: item[k].strip() if isinstance(item[k], str) else item[k] for k in DETAIL_KEYS}
+
+
+def parse_grid(response: Response) -> List[Dict]:
+    """
+    Reads an IntraWeb grid tab, the header row keys every following row. Header keys are
+    interned, so the rows of every permit in flight share one copy of each.
+    """
+    root = response.selector.root
+    headers = [sys.intern(header) for header in GRID_HEADERS(root)]
+    item = []
+    for row in GRID_ROWS(root)[1:]:
+        row_item = {}
+        for header, value in zip(headers, GRID_CELLS(row)):
+            value = value.strip()
+            if value:
+                row_item[header] = value
+        if row_item:
+            item.append(row_item)
+    return item
+
+
+def parse_tabs_status(response: Response) -> Dict:
+    """
+    Returns the `data-badge` row counts of the detail iframe tabs.
+    """
+    scripts = BADGE_SCRIPT(response.selector.root)
+    statuses = BADGE_COUNT.findall(etree.tostring(scripts[0], method="html", encoding="unicode", with_tail=False)) if scripts else []
+    if statuses and len(statuses) == len(BADGE_TABS):
+        return {tab: int(count or 0) for tab, count in zip(BADGE_TABS, statuses)}
+    return {}
@@ -0,0 +1,177 @@
+from datetime import datetime
+import json
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional, Tuple
+import zlib
+
+
+
+DAY = 86400
+FINAL_STATUSES = ("COED", "CANCEL", "VOID")
+DEFAULT_TTLS = {"EXPIRED": 30 * DAY}
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.strptime(value.strip(), "%m/%d/%Y")
+    except (AttributeError, ValueError):
+        return None
+
+
+class PermitCache:
+    """
+    Scraped items kept across runs, keyed by permit. Final permits (a status in `final_statuses`
+    or a CO date in the past) never expire, others after `ttls[status]` or `default_ttl` seconds.
+    Past `max_bytes` of items, expired entries are evicted first, then the ones closest to expiry.
+    Each entry also keeps the detail page badge counts it was scraped with, for delta refreshes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttls: Dict[str, float] = None,
+        default_ttl: float = DAY,
+        final_statuses: Iterable[str] = FINAL_STATUSES,
+        max_bytes: int = 512 * 1024 * 1024,
+        batch_size: int = 500,
+    ):
+        self.path = path
+        self.ttls = {status.upper(): ttl for status, ttl in (DEFAULT_TTLS if ttls is None else ttls).items()}
+        self.default_ttl = default_ttl
+        self.final_statuses = {status.upper() for status in final_statuses}
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        # several crawl processes may share one cache file
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "permit TEXT PRIMARY KEY, status TEXT, fetched_at REAL NOT NULL, expires_at REAL, size INTEGER NOT NULL, item BLOB NOT NULL, badges TEXT"
+            ")"
+        )
+        if "badges" not in {row[1] for row in self.conn.execute("PRAGMA table_info(items)")}:
+            self.conn.execute("ALTER TABLE items ADD COLUMN badges TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS items_expires_at ON items (expires_at)")
+        self.conn.commit()
+        self._pending: Dict[str, Tuple[Optional[str], float, Optional[float], bytes, Optional[str]]] = {}
+        self.evicted = 0
+
+
+    def expires_at(self, item: Dict, now: float) -> Optional[float]:
+        """
+        When `item` goes stale, None for never.
+        """
+        detail = item.get("detail") or {}
+        status = (detail.get("permit_status") or "").strip().upper()
+        if status in self.final_statuses:
+            return None
+        co_date = parse_date(detail.get("co_date"))
+        if co_date is not None and co_date.timestamp() < now:
+            return None
+        ttl = self.ttls.get(status, self.default_ttl)
+        return None if ttl is None else now + ttl
+
+
+    def get(self, permit: str, now: float = None) -> Optional[Dict]:
+        now = time.time() if now is None else now
+        if permit in self._pending:
+            _, _, expires_at, blob, _ = self._pending[permit]
+        else:
+            row = self.conn.execute("SELECT expires_at, item FROM items WHERE permit = ?", (permit,)).fetchone()
+            if row is None:
+                return None
+            expires_at, blob = row
+        if expires_at is not None and expires_at <= now:
+            return None
+        return json.loads(zlib.decompress(blob))
+
+
+    def contains(self, permit: str) -> bool:
+        if permit in self._pending:
+            return True
+        return self.conn.execute("SELECT 1 FROM items WHERE permit = ?", (permit,)).fetchone() is not None
+
+
+    def snapshot(self, permit: str) -> Optional[Tuple[Dict, Dict]]:
+        """
+        The last item and badge counts scraped for `permit`, fresh or not. None when the
+        entry predates badge counts.
+        """
+        if permit in self._pending:
+            _, _, _, blob, badges = self._pending[permit]
+        else:
+            row = self.conn.execute("SELECT item, badges FROM items WHERE permit = ?", (permit,)).fetchone()
+            if row is None:
+                return None
+            blob, badges = row
+        if not badges:
+            return None
+        return json.loads(zlib.decompress(blob)), json.loads(badges)
+
+
+    def put(self, item: Dict, badges: Dict = None, now: float = None) -> None:
+        now = time.time() if now is None else now
+        blob = zlib.compress(json.dumps(item, separators=(",", ":")).encode())
+        status = (item.get("detail") or {}).get("permit_status")
+        self._pending[item["permit"]] = (status, now, self.expires_at(item, now), blob, json.dumps(badges) if badges else None)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+
+    def size(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM items").fetchone()[0]
+
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        rows = [
+            (permit, status, fetched_at, expires_at, len(blob), blob, badges)
+            for permit, (status, fetched_at, expires_at, blob, badges) in self._pending.items()
+        ]
+        self._pending = {}
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO items (permit, status, fetched_at, expires_at, size, item, badges) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(permit) DO UPDATE SET status = excluded.status, fetched_at = excluded.fetched_at, "
+                "expires_at = excluded.expires_at, size = excluded.size, item = excluded.item, badges = excluded.badges",
+                rows,
+            )
+        if self.max_bytes and self.size() > self.max_bytes:
+            self.evict()
+
+
+    def evict(self, now: float = None) -> int:
+        """
+        Trims the cache to `max_bytes`: expired items go first, then the soonest to expire,
+        final ones last. Freed pages are handed back to the file system.
+        """
+        now = time.time() if now is None else now
+        with self.conn:
+            evicted = self.conn.execute("DELETE FROM items WHERE expires_at <= ?", (now,)).rowcount
+            excess = self.size() - self.max_bytes
+            if excess > 0:
+                victims = []
+                for permit, size in self.conn.execute("SELECT permit, size FROM items ORDER BY expires_at IS NULL, expires_at, fetched_at"):
+                    victims.append((permit,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self.conn.executemany("DELETE FROM items WHERE permit = ?", victims)
+                evicted += len(victims)
+        self.conn.execute("PRAGMA incremental_vacuum")
+        self.evicted += evicted
+        return evicted
+
+
+    def counts(self) -> Dict[str, int]:
+        self.flush()
+        return dict(self.conn.execute("SELECT COALESCE(status, ''), COUNT(*) FROM items GROUP BY status").fetchall())
+
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
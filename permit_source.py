@@ -0,0 +1,154 @@
+import heapq
+import json
+import tempfile
+from typing import IO, Any, Iterable, Iterator, List, Optional, Tuple
+import zlib
+
+
+
+CHUNK_SIZE = 1 << 16
+
+
+def iter_json_array(f: IO[str]) -> Iterator[Any]:
+    """
+    Yields the elements of a top-level JSON array one by one, reading the file in chunks.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        chunk = f.read(CHUNK_SIZE)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+        return not eof
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+        if pos < len(buf):
+            break
+        if not fill():
+            return
+    if buf[pos] != "[":
+        raise ValueError("expected a JSON array")
+    pos += 1
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buf):
+            if not fill():
+                raise ValueError("unterminated JSON array")
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if not fill():
+                raise
+            continue
+        if not eof and (end == len(buf) or buf[end] not in " \t\r\n,]"):
+            # a number may continue in the next chunk, `1500` of `1500.0` decodes on its own
+            fill()
+            continue
+        pos = end
+        yield value
+
+
+def flatten(value: Any) -> Iterator[str]:
+    """
+    Turns one input record into permit ids: `{"permit": ...}` objects contribute their values.
+    """
+    if isinstance(value, dict):
+        for v in value.values():
+            yield from flatten(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from flatten(v)
+    elif value is not None:
+        text = str(value).strip()
+        if text:
+            yield text
+
+
+def read_permits(path: str, fmt: Optional[str] = None) -> Iterator[str]:
+    """
+    Streams raw permit ids from a JSON array (`.json`), JSON lines (`.jsonl`, `.ndjson`) or plain text file.
+    """
+    fmt = fmt or ("json" if path.endswith(".json") else "jsonl" if path.endswith((".jsonl", ".ndjson")) else "text")
+    with open(path, "r") as f:
+        if fmt == "json":
+            for value in iter_json_array(f):
+                yield from flatten(value)
+        elif fmt == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield from flatten(json.loads(line))
+        else:
+            for line in f:
+                yield from flatten(line)
+
+
+def parse_shard(spec: Optional[str]) -> Tuple[int, int]:
+    """
+    Parses `i/N` into `(i, N)`, with `0 <= i < N`.
+    """
+    if not spec:
+        return 0, 1
+    index, _, count = spec.partition("/")
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f"invalid shard {spec!r}, expected i/N with 0 <= i < N")
+    return index, count
+
+
+def in_shard(permit: str, index: int, count: int) -> bool:
+    # crc32 is stable across processes and runs, unlike hash()
+    return count == 1 or zlib.crc32(permit.encode()) % count == index
+
+
+def dedupe(permits: Iterable[str], run_size: int = 1_000_000) -> Iterator[str]:
+    """
+    Sorted, duplicate-free stream of `permits` holding at most `run_size` ids in memory.
+    Larger inputs are spilled to sorted temporary runs that are merged lazily.
+    """
+    runs: List[IO[str]] = []
+    buf = set()
+    for permit in permits:
+        buf.add(permit)
+        if len(buf) >= run_size:
+            runs.append(spill(buf))
+            buf = set()
+    if not runs:
+        yield from sorted(buf)
+        return
+    if buf:
+        runs.append(spill(buf))
+
+    last = None
+    try:
+        for line in heapq.merge(*runs):
+            permit = line.rstrip("\n")
+            if permit != last:
+                yield permit
+                last = permit
+    finally:
+        for run in runs:
+            run.close()
+
+
+def spill(permits: set) -> IO[str]:
+    run = tempfile.TemporaryFile("w+")
+    run.writelines(permit + "\n" for permit in sorted(permits))
+    run.seek(0)
+    return run
+
+
+def iter_permits(path: str, shard: Optional[str] = None, run_size: int = 1_000_000, fmt: Optional[str] = None) -> Iterator[str]:
+    """
+    Deterministic, deduplicated permit ids of one shard of the input file.
+    """
+    index, count = parse_shard(shard)
+    return dedupe((p for p in read_permits(path, fmt) if in_shard(p, index, count)), run_size)
@@ -0,0 +1,265 @@
+"""
+Partitioned output: scraped items streamed into rotated, gzip compressed JSONL files.
+
+    <partition dir>/items/part-20240105T101500-4242-0003.jsonl.gz     one scraped item per line
+    <partition dir>/inspections/part-....jsonl.gz                     with PARTITION_NORMALIZE, one row
+                                                                      per grid row, keyed by permit
+
+Enabled by the `PARTITION_DIR` setting. A partition is written as `*.jsonl.gz.tmp` and renamed
+once it is rotated (past `PARTITION_MAX_BYTES` of JSON or `PARTITION_MAX_SECONDS` old, 0 for
+no limit) or the crawl closes, so loaders can pick up every `*.jsonl.gz` as complete. The process id in file
+names keeps supervisor workers sharing one directory apart.
+"""
+from datetime import datetime
+import gzip
+import json
+import os
+from pathlib import Path
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from permit_cache import parse_date
+
+
+
+def iso_date(value: Optional[str]) -> Optional[str]:
+    date = parse_date(value)
+    return date.date().isoformat() if date is not None else None
+
+
+def parse_amount(value: Optional[str]) -> Optional[float]:
+    """
+    `$1,397.00` as 1397.0, `($25.00)` as -25.0.
+    """
+    if not value:
+        return None
+    raw = value.strip()
+    negative = raw.startswith("(") and raw.endswith(")") or raw.startswith("-")
+    try:
+        amount = float(raw.strip("()-").replace("$", "").replace(",", ""))
+    except ValueError:
+        return None
+    return -amount if negative else amount
+
+
+def text(value: Optional[str]) -> Optional[str]:
+    return value or None
+
+
+def column_name(header: str) -> str:
+    return "_".join("".join(c if c.isalnum() else " " for c in header.lower()).split())
+
+
+# item key -> table name and grid header -> (column, converter)
+GRID_TABLES: Dict[str, Tuple[str, Dict[str, Tuple[str, Callable]]]] = {
+    "inspection": ("inspections", {
+        "CODE": ("code", text),
+        "DESCRIPTION": ("description", text),
+        "REQUEST DATE": ("request_date", iso_date),
+        "RESULT DATE": ("result_date", iso_date),
+        "RESULT": ("result", text),
+    }),
+    "reviews": ("reviews", {
+        "REVIEW DEPARTMENT": ("department", text),
+        "STATUS": ("status", text),
+        "OUT DATE": ("out_date", iso_date),
+        "RELEASED": ("released_date", iso_date),
+    }),
+    "permit_holds": ("holds", {
+        "HOLD TYPE": ("hold_type", text),
+        "COMMENT": ("comment", text),
+    }),
+    "fees": ("fees", {
+        "FEE": ("fee", text),
+        "DESCRIPTION": ("description", text),
+        "AMT DUE": ("amount_due", parse_amount),
+        "AMT PAID": ("amount_paid", parse_amount),
+        "STATUS": ("status", text),
+    }),
+    "subs": ("subs", {
+        "DBA": ("dba", text),
+        "Status": ("status", text),
+        "State #": ("state_number", text),
+        "TYPE": ("type", text),
+    }),
+    "cos": ("cos", {
+        "CO #": ("co_number", text),
+        "CO TYPE": ("co_type", text),
+        "STATUS": ("status", text),
+        "ISSUED DATE": ("issued_date", iso_date),
+    }),
+}
+PERMIT_DATES = ("apply_date", "issued_date", "co_date", "expiration_date", "last_inspection_request", "last_inspection_result")
+
+
+def normalize(item: Dict) -> Iterator[Tuple[str, Dict]]:
+    """
+    Splits a scraped item into `(table, row)` pairs: one `permits` row with the detail fields
+    and one row per grid row in its tab's table, dates as ISO strings and amounts as numbers.
+    Headers the site adds later are kept under their snake_case name.
+    """
+    permit = item["permit"]
+    detail = item.get("detail") or {}
+    row = {"permit": permit}
+    for key, value in detail.items():
+        row[key] = iso_date(value) if key in PERMIT_DATES else value
+    yield "permits", row
+
+    for key, (table, columns) in GRID_TABLES.items():
+        for grid_row in item.get(key) or ():
+            row = {"permit": permit}
+            for header, value in grid_row.items():
+                column, convert = columns.get(header) or (column_name(header), text)
+                row[column] = convert(value)
+            yield table, row
+
+
+
+class Partition:
+    """
+    One table's open partition file. Lines are buffered and compressed `batch_size` at a time.
+    """
+
+    def __init__(self, root: Path, table: str, compresslevel: int = 6):
+        self.root = root / table
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.compresslevel = compresslevel
+        self.seq = 0
+        self.files = 0
+        self.rows = 0
+        self.path: Optional[Path] = None
+        self.file = None
+        # when the first row of this partition came in, buffered or written
+        self.started_at: Optional[float] = None
+        self.written = 0
+        self.buffer: List[bytes] = []
+
+
+    def append(self, line: bytes) -> None:
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        self.buffer.append(line)
+
+
+    def open(self) -> None:
+        self.seq += 1
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        self.path = self.root / f"part-{stamp}-{os.getpid()}-{self.seq:04d}.jsonl.gz"
+        self.file = gzip.open(self.path.with_name(self.path.name + ".tmp"), "wb", compresslevel=self.compresslevel)
+        self.written = 0
+
+
+    def write(self, lines: List[bytes]) -> None:
+        if self.file is None:
+            self.open()
+        data = b"".join(lines)
+        self.file.write(data)
+        self.written += len(data)
+        self.rows += len(lines)
+
+
+    def rotate(self) -> None:
+        """
+        Closes the open file and publishes it under its final name.
+        """
+        self.started_at = None
+        if self.file is None:
+            return
+        self.file.close()
+        self.path.with_name(self.path.name + ".tmp").replace(self.path)
+        self.file = None
+        self.files += 1
+
+
+
+class PartitionedJsonlPipeline:
+    """
+    Item pipeline writing items, or their normalized table rows, to rotated gzip JSONL partitions.
+    Items pass through unchanged, so feed exports can run alongside or be switched off.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 256 * 1024 * 1024, max_seconds: float = 3600, batch_size: int = 500, normalize: bool = False, compresslevel: int = 6):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.compresslevel = compresslevel
+        self.partitions: Dict[str, Partition] = {}
+        self.stats = None
+        self._task = None
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        root = settings.get("PARTITION_DIR")
+        if not root:
+            raise NotConfigured
+        pipeline = cls(
+            root,
+            max_bytes=settings.getint("PARTITION_MAX_BYTES", 256 * 1024 * 1024),
+            max_seconds=settings.getfloat("PARTITION_MAX_SECONDS", 3600),
+            batch_size=settings.getint("PARTITION_BATCH_SIZE", 500),
+            normalize=settings.getbool("PARTITION_NORMALIZE", False),
+            compresslevel=settings.getint("PARTITION_COMPRESSLEVEL", 6),
+        )
+        pipeline.stats = crawler.stats
+        return pipeline
+
+
+    def open_spider(self, spider=None):
+        # quiet tables, and quiet spells of the crawl, still get their partitions published on time
+        if self.max_seconds:
+            self._task = task.LoopingCall(self.rotate_expired)
+            self._task.start(min(self.max_seconds, 60), now=False)
+
+
+    def process_item(self, item, spider=None):
+        rows = normalize(item) if self.normalize else (("items", item),)
+        for table, row in rows:
+            partition = self.partitions.get(table)
+            if partition is None:
+                partition = self.partitions[table] = Partition(self.root, table, self.compresslevel)
+            partition.append(json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode() + b"\n")
+            if len(partition.buffer) >= self.batch_size:
+                self.flush(partition)
+        self.rotate_expired()
+        return item
+
+
+    def flush(self, partition: Partition) -> None:
+        lines, partition.buffer = partition.buffer, []
+        if lines:
+            partition.write(lines)
+        if self.max_bytes and partition.written >= self.max_bytes or self.expired(partition):
+            partition.rotate()
+
+
+    def expired(self, partition: Partition) -> bool:
+        # a max of 0 turns time rotation off
+        return bool(self.max_seconds) and partition.started_at is not None and time.monotonic() - partition.started_at >= self.max_seconds
+
+
+    def rotate_expired(self) -> None:
+        """
+        Writes out and publishes every partition past `max_seconds`, however few rows it has.
+        """
+        for partition in self.partitions.values():
+            if self.expired(partition):
+                self.flush(partition)
+
+
+    def close_spider(self, spider=None):
+        if self._task is not None and self._task.running:
+            self._task.stop()
+        for table, partition in self.partitions.items():
+            self.flush(partition)
+            partition.rotate()
+            if self.stats is None:
+                continue
+            self.stats.set_value(f"partitions/{table}/files", partition.files)
+            self.stats.set_value(f"partitions/{table}/rows", partition.rows)
@@ -0,0 +1,215 @@
+"""
+Local stand-in for `webpermits.dll` that replays recorded cassettes.
+
+    python replay_server.py CASSETTE_DIR [--port 8080] [--latency 150] [--capacity 8] [--strict] [--expire-rate 0.01]
+
+Point the spider at it with `-s MARIONFL_BASE_URL=http://127.0.0.1:8080/webpermits.dll`.
+Every landing GET (any path without `/$/`) opens a new session id. Responses are picked by what the session did
+(`cassette.ReplayState`), recorded session ids are swapped for the live one, and trackids
+are shifted so they follow on from the trackid the client sent. With `--strict`, an ajax
+request whose trackid is not the last one issued gets an expired-session page, like a desynced
+IntraWeb session would. `--expire-rate` kills that share of sessions mid-permit, answering the
+ajax callback with an expired-session page. `--capacity` makes the server work on that many
+requests at once and queue the rest, so latency grows with load like on a busy county server.
+`GET /__stats__` returns request counters as JSON.
+"""
+import argparse
+import asyncio
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+import json
+import logging
+import random
+import re
+import secrets
+from typing import Dict, Optional, Tuple
+
+from cassette import ReplayState, find_cassettes, parse_form, read_cassette, split_target
+from intraweb import extract_trackid
+
+
+logger = logging.getLogger("replay_server")
+
+TRACKID_TOKENS = re.compile(rb'(<trackid>\s*|"IW_TrackID_":\s*)(\d+)')
+NO_MATCH = b"<?xml version=\"1.0\" encoding=\"UTF-8\"?><response><trackid>%d</trackid><execute>alert('No matching permit found');</execute></response>"
+EXPIRED = b"<html><body><h1>Session has expired</h1></body></html>"
+REASONS = {200: "OK", 404: "Not Found"}
+
+
+
+@dataclass
+class Recorded:
+    session_id: str
+    trackid: Optional[int]
+    status: int
+    content_type: str
+    body: bytes
+
+
+
+@dataclass
+class LiveSession:
+    session_id: str
+    state: ReplayState = field(default_factory=ReplayState)
+    expected_trackid: Optional[int] = None
+
+
+
+class ReplayServer:
+
+    def __init__(self, latency: float = 0, jitter: float = 0, strict: bool = False, expire_rate: float = 0, capacity: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = asyncio.Semaphore(capacity) if capacity else None
+        self.strict = strict
+        self.expire_rate = expire_rate
+        self.landings = []
+        self.exchanges: Dict[Tuple, Recorded] = {}
+        self.sessions: Dict[str, LiveSession] = {}
+        self.stats = dict(requests=0, sessions=0, permits=0, misses=0, desyncs=0, expired=0, killed=0)
+
+
+    def load(self, root: str) -> None:
+        for path in find_cassettes(root):
+            state = ReplayState()
+            for exchange, body in read_cassette(path):
+                trackid = exchange["form"].get("IW_TrackID_") or exchange["query"].get("IW_TrackID_")
+                recorded = Recorded(exchange["session_id"], int(trackid) if trackid else None, exchange["status"], exchange["content_type"], body)
+                if exchange["step"] == "landing":
+                    self.landings.append(recorded)
+                    state = ReplayState()
+                    continue
+                key, permit = state.key(exchange["method"], exchange["query"], exchange["form"])
+                self.exchanges.setdefault((key, permit), recorded)
+        logger.info(f"Loaded {len(self.exchanges)} exchanges and {len(self.landings)} landing pages")
+
+
+    def respond(self, method: str, target: str, body: bytes) -> Tuple[int, str, bytes]:
+        path, query = split_target(target)
+        if path.endswith("/__stats__"):
+            return 200, "application/json", json.dumps(self.stats).encode()
+        self.stats["requests"] += 1
+
+        segments = path.split("/")
+        session = next((self.sessions[s] for s in segments if s in self.sessions), None)
+        if session is None:
+            if method != "GET" or "/$/" in path or not self.landings:
+                self.stats["expired"] += 1
+                return 200, "text/html", EXPIRED
+            return self.open_session()
+
+        form = parse_form(body)
+        sent = form.get("IW_TrackID_") or query.get("IW_TrackID_")
+        sent = int(sent) if sent and sent.isdigit() else None
+        is_ajax = "callback" in query
+        if self.strict and is_ajax and session.state.permit is not None and session.expected_trackid not in (None, sent):
+            self.stats["desyncs"] += 1
+            del self.sessions[session.session_id]
+            return 200, "text/html", EXPIRED
+        if self.expire_rate and is_ajax and session.state.permit is not None and random.random() < self.expire_rate:
+            self.stats["killed"] += 1
+            del self.sessions[session.session_id]
+            return 200, "text/html", EXPIRED
+
+        key, permit = session.state.key(method, query, form)
+        if "EDTPERMITNBR" in form and query.get("callback", "").startswith("EDTPERMITNBR"):
+            self.stats["permits"] += 1
+        recorded = self.exchanges.get((key, permit)) or self.exchanges.get((key, None))
+        if recorded is None:
+            if "EDTPERMITNBR" in form:
+                payload = NO_MATCH % ((sent or 0) + 1)
+                session.expected_trackid = (sent or 0) + 1
+                return 200, "text/xml", payload
+            self.stats["misses"] += 1
+            return 404, "text/html", b"no recorded exchange for " + repr(key).encode()
+
+        payload = recorded.body.replace(recorded.session_id.encode(), session.session_id.encode())
+        if sent is not None and recorded.trackid is not None and sent != recorded.trackid:
+            offset = sent - recorded.trackid
+            payload = TRACKID_TOKENS.sub(lambda m: m.group(1) + str(int(m.group(2)) + offset).encode(), payload)
+        if is_ajax:
+            trackid = extract_trackid(payload)
+            session.expected_trackid = int(trackid) if trackid else session.expected_trackid
+        return recorded.status, recorded.content_type, payload
+
+
+    def open_session(self) -> Tuple[int, str, bytes]:
+        session = LiveSession(secrets.token_hex(10).upper())
+        self.sessions[session.session_id] = session
+        self.stats["sessions"] += 1
+        recorded = self.landings[self.stats["sessions"] % len(self.landings)]
+        return recorded.status, recorded.content_type, recorded.body.replace(recorded.session_id.encode(), session.session_id.encode())
+
+
+    async def serve_request(self, method: str, target: str, body: bytes) -> Tuple[int, str, bytes]:
+        status, content_type, payload = self.respond(method, target, body)
+        if self.latency or self.jitter:
+            await asyncio.sleep((self.latency + random.uniform(0, self.jitter)) / 1000)
+        return status, content_type, payload
+
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                async with self.capacity or nullcontext():
+                    status, content_type, payload = await self.serve_request(method, target, body)
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port)
+
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cassettes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0, help="added delay per response, ms")
+    parser.add_argument("--jitter", type=float, default=0, help="random extra delay up to this many ms")
+    parser.add_argument("--capacity", type=int, default=0, help="requests served at once, the rest queue; 0 for unlimited")
+    parser.add_argument("--strict", action="store_true", help="expire sessions that send a stale trackid")
+    parser.add_argument("--expire-rate", type=float, default=0, help="chance that an ajax callback mid-permit kills its session")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
+
+    server = ReplayServer(args.latency, args.jitter, args.strict, args.expire_rate, args.capacity)
+    server.load(args.cassettes)
+
+    async def run():
+        listener = await server.serve(args.host, args.port)
+        logger.info(f"Replaying on http://{args.host}:{args.port}/webpermits.dll")
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional
+
+
+
+@dataclass
+class IntraWebSession:
+    session_id: str
+    window_id: str
+    trackid: str
+    created: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    uses: int = 0
+
+
+
+class SessionPool:
+    """
+    Keeps warmed IntraWeb sessions parked on FrmMain, so a permit only pays for the
+    handshake when no idle session is available.
+    """
+
+    def __init__(self, factory: Callable[[], Awaitable[IntraWebSession]], size: int = 4, idle_expiry: float = 600, max_uses: int = 0):
+        self.factory = factory
+        self.size = size
+        self.idle_expiry = idle_expiry
+        self.max_uses = max_uses
+        self.opened = 0
+        self.reused = 0
+        self._idle: List[IntraWebSession] = []
+        self._open = 0
+        self._cond = asyncio.Condition()
+
+
+    async def acquire(self) -> IntraWebSession:
+        """
+        Returns the most recently used idle session, or opens a new one while under `size`.
+        Waits for a release once the pool is full.
+        """
+        async with self._cond:
+            while True:
+                self._drop_expired()
+                if self._idle:
+                    self.reused += 1
+                    return self._idle.pop()
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                await self._cond.wait()
+        try:
+            session = await self.factory()
+        except BaseException:
+            await self.discard()
+            raise
+        self.opened += 1
+        return session
+
+
+    async def release(self, session: IntraWebSession) -> None:
+        """
+        Parks a session that is back on FrmMain so the next permit can use it.
+        """
+        session.last_used = time.monotonic()
+        session.uses += 1
+        async with self._cond:
+            if self.max_uses and session.uses >= self.max_uses:
+                self._open -= 1
+            else:
+                self._idle.append(session)
+            self._cond.notify()
+
+
+    async def discard(self, session: Optional[IntraWebSession] = None) -> None:
+        """
+        Forgets a session that is dead or in an unknown state, freeing its slot.
+        """
+        async with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+
+    def _drop_expired(self) -> None:
+        if not self.idle_expiry:
+            return
+        deadline = time.monotonic() - self.idle_expiry
+        alive = [s for s in self._idle if s.last_used >= deadline]
+        self._open -= len(self._idle) - len(alive)
+        self._idle = alive
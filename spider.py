@@ -1,34 +1,275 @@
-from itertools import chain
+import asyncio
+from contextlib import nullcontext
+from itertools import islice
 import json
 import random
-import re
 import string
-from typing import Dict, Iterable, Tuple
+import time
+from typing import Dict, Iterable, Optional, Tuple
 from urllib.parse import urlencode
 import scrapy
+from scrapy import signals
 from scrapy.crawler import CrawlerProcess
-from scrapy.http import Response
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Headers, Response
+from scrapy.responsetypes import responsetypes
+from scrapy.settings import Settings
 from scrapy.utils.defer import maybe_deferred_to_future
 
+from flow_control import FlowController
+from http_client import HTTPClient
+from intraweb import extract_script, extract_session_state, extract_trackid
+from ledger import FAILED, NONEXISTENT, SCRAPED, PermitLedger
+from metrics import StepMetrics
+from parsers import parse_tabs_status
+from permit_cache import DEFAULT_TTLS, FINAL_STATUSES, PermitCache
+from permit_source import iter_permits
+from session_pool import IntraWebSession, SessionPool
+from tabs import DETAIL, GRID_TABS, Tab, select_tabs
+
+
+BASE_URL = "https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll"
+DEAD_SESSION_MARKERS = ["session has expired", "session has timed out", "invalid session"]
+# a callback script switching the browser back to the start form, the server reset the session
+START_FORM_MARKERS = ["IW_FormName=FrmStart", "'FrmStart'", '"FrmStart"']
+
+
+class SessionExpired(Exception):
+    pass
+
 
 
 class Marionfl(scrapy.Spider):
     name = "marionfl_spider"
+    permits = "permits.json"
+    shard = None
+    limit = None
+    tabs = None
+    refresh = None
+
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        spider.base_url = settings.get("MARIONFL_BASE_URL", BASE_URL).rstrip("/")
+        spider.session_pool = SessionPool(
+            spider.open_session,
+            size=settings.getint("SESSION_POOL_SIZE", 4),
+            idle_expiry=settings.getfloat("SESSION_POOL_IDLE_EXPIRY", 600),
+            max_uses=settings.getint("SESSION_POOL_MAX_USES", 0),
+        )
+        # the pool size is the hard ceiling on sessions, the controller moves below it
+        spider.flow_control = None
+        if settings.getbool("FLOW_CONTROL_ENABLED", True):
+            spider.flow_control = FlowController(
+                initial=settings.getint("FLOW_CONTROL_INITIAL", 4),
+                minimum=settings.getint("FLOW_CONTROL_MIN", 1),
+                maximum=spider.session_pool.size,
+                backoff=settings.getfloat("FLOW_CONTROL_BACKOFF", 0.5),
+                latency_factor=settings.getfloat("FLOW_CONTROL_LATENCY_FACTOR", 2.0),
+            )
+        # permits past start() each hold a coroutine, a placeholder request and its partial item,
+        # so only a few rounds of sessions' worth are let in at a time
+        spider.pending_permits = asyncio.Semaphore(settings.getint("PERMITS_MAX_PENDING", 4 * spider.session_pool.size))
+        crawler.signals.connect(spider.request_dropped, signal=signals.request_dropped)
+        spider.http_client = None
+        if settings.get("HTTP_ENGINE", "scrapy") == "asyncio":
+            spider.http_client = HTTPClient(timeout=settings.getfloat("DOWNLOAD_TIMEOUT", 180), max_idle=spider.session_pool.size)
+            spider.request_headers = {"User-Agent": settings.get("USER_AGENT"), **settings.getdict("DEFAULT_REQUEST_HEADERS")}
+        spider.grid_tabs = select_tabs(spider.tabs)
+        # `-a refresh=...` arrives as a string, `-a refresh=0` must not switch it on
+        spider.refresh = str(spider.refresh).lower() in ("1", "true", "yes")
+        # matched against the raw body, so step responses never cache a decoded copy of it
+        spider.dead_session_markers = [m.lower().encode() for m in settings.getlist("SESSION_POOL_DEAD_MARKERS", DEAD_SESSION_MARKERS)]
+        spider.start_form_markers = [m.lower().encode() for m in settings.getlist("SESSION_START_FORM_MARKERS", START_FORM_MARKERS)]
+        spider.session_recoveries = settings.getint("SESSION_RECOVERY_TIMES", 3)
+        spider.step_retry_times = settings.getint("STEP_RETRY_TIMES", 2)
+        spider.step_retry_codes = {int(code) for code in settings.getlist("RETRY_HTTP_CODES")}
+        spider.step_retry_backoff = settings.getfloat("STEP_RETRY_BACKOFF", 0.5)
+        spider.step_retry_backoff_max = settings.getfloat("STEP_RETRY_BACKOFF_MAX", 10)
+        spider.metrics = StepMetrics.from_crawler(crawler)
+        crawler.signals.connect(spider.metrics.start, signal=signals.spider_opened)
+        spider.ledger = None
+        if settings.get("LEDGER_PATH"):
+            spider.ledger = PermitLedger(
+                settings.get("LEDGER_PATH"),
+                batch_size=settings.getint("LEDGER_BATCH_SIZE", 500),
+                flush_interval=settings.getfloat("LEDGER_FLUSH_INTERVAL", 5.0),
+            )
+            crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        spider.cache = None
+        if settings.get("PERMIT_CACHE_PATH"):
+            spider.cache = PermitCache(
+                settings.get("PERMIT_CACHE_PATH"),
+                ttls=settings.getdict("PERMIT_CACHE_TTLS", DEFAULT_TTLS),
+                default_ttl=settings.getfloat("PERMIT_CACHE_DEFAULT_TTL", 86400),
+                final_statuses=settings.getlist("PERMIT_CACHE_FINAL_STATUSES", FINAL_STATUSES),
+                max_bytes=settings.getint("PERMIT_CACHE_MAX_MB", 512) * 1024 * 1024,
+            )
+        spider.delta_refresh = settings.getbool("PERMIT_CACHE_DELTA_REFRESH", True)
+        return spider
+
+
+    async def start(self):
+        # Scrapy >= 2.13 entry point, which may wait: parse(), or permit_dropped() for a placeholder
+        # that never gets there, frees the slot of each admitted permit
+        for request in self.start_requests():
+            if isinstance(request, scrapy.Request):
+                await self.pending_permits.acquire()
+            yield request
 
 
     def start_requests(self) -> Iterable[scrapy.Request]:
         """
-        Entry point, Generates the initial requests to the website.
+        Entry point, Generates one request per permit. Sessions come from the pool,
+        so the request itself is a local `data:` placeholder that never hits the website.
+        Permits with a fresh entry in the permit cache are yielded as items straight away.
+        Spider arguments: `permits` (JSON array, JSONL or text file), `shard` (`i/N`), `limit`,
+        `tabs` (comma separated tab names, all tabs by default) and `refresh` (`1`, `true` or `yes` to revisit cached
+        permits even while they are fresh).
         """
-        url = "https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll"
-        with open("permits.json", 'r') as f:
-            permits = list(set(chain.from_iterable(item.values() for item in json.load(f))))
-        for permit in permits[:105]:
-            yield scrapy.Request(url, callback=self.parse, cb_kwargs={"permit": permit}, dont_filter=True)
+        permits = iter_permits(self.permits, shard=self.shard, run_size=self.settings.getint("PERMITS_DEDUPE_RUN_SIZE", 1_000_000))
+        for permit in islice(permits, int(self.limit) if self.limit is not None else None):
+            # a refresh revisits permits whatever an interrupted run left in the ledger
+            if self.ledger is not None and not self.refresh and self.ledger.is_finished(permit):
+                self.crawler.stats.inc_value("ledger/skipped")
+                continue
+            if self.cache is not None and not self.refresh:
+                item = self.cache.get(permit)
+                if item is not None and all(tab.item_key in item for tab in self.grid_tabs):
+                    self.crawler.stats.inc_value("cache/hits")
+                    # shaped like a scraped item: unselected tabs are left out
+                    yield {key: item[key] for key in ("permit", DETAIL.item_key, *(tab.item_key for tab in self.grid_tabs)) if key in item}
+                    continue
+                self.crawler.stats.inc_value("cache/misses")
+            yield scrapy.Request("data:,", callback=self.parse, errback=self.permit_dropped, cb_kwargs={"permit": permit}, dont_filter=True)
 
     
     async def parse(self, response: Response, permit: str) -> Dict:
-        session_id, window_id = response.xpath("//input[@name='IW_SessionID_']/@value").get(), response.xpath("//input[@name='IW_WindowID_']/@value").get()
+        try:
+            async with self.flow_control or nullcontext():
+                item = await self.scrape_permit(permit)
+        except Exception as e:
+            if self.ledger is not None:
+                self.ledger.record(permit, FAILED, error=repr(e))
+            raise
+        finally:
+            self.pending_permits.release()
+        if item is None and self.ledger is not None:
+            self.ledger.record(permit, NONEXISTENT)
+        return item
+
+
+    def permit_dropped(self, failure) -> None:
+        """
+        Errback of the placeholder requests: the permit never reaches parse(), so its slot
+        is handed back here.
+        """
+        self.drop_permit(failure.request.cb_kwargs["permit"], repr(failure.value))
+
+
+    def request_dropped(self, request: scrapy.Request, spider: scrapy.Spider) -> None:
+        # the scheduler rejects requests without calling their errback
+        if request.errback == self.permit_dropped:
+            self.drop_permit(request.cb_kwargs["permit"], "dropped by the scheduler")
+
+
+    def drop_permit(self, permit: str, error: str) -> None:
+        self.pending_permits.release()
+        self.logger.warning(f"Permit {permit} dropped before scraping: {error}")
+        if self.ledger is not None:
+            self.ledger.record(permit, FAILED, error=error)
+
+
+    async def scrape_permit(self, permit: str) -> Dict:
+        """
+        Runs the permit flow on a pooled session. When the session expires or falls out of sync
+        partway, it is replaced (up to `SESSION_RECOVERY_TIMES` times) and the flow resumes
+        from the tab it was on, keeping the tabs already scraped. A permit in the cache is
+        refreshed as a delta: tabs whose badge count and watched detail fields did not move
+        are taken from the previous snapshot instead of being fetched.
+        """
+        item = dict(permit=permit)
+        previous = self.cache.snapshot(permit) if self.cache is not None and self.delta_refresh else None
+        recoveries = 0
+        while True:
+            session = await self.session_pool.acquire()
+            try:
+                exists, trackid, badges = await self.permit_flow(session, permit, item, previous)
+            except SessionExpired as e:
+                await self.session_pool.discard(session)
+                self.metrics.inc("sessions/expired")
+                if self.flow_control is not None:
+                    self.flow_control.failure()
+                if recoveries >= self.session_recoveries:
+                    raise
+                recoveries += 1
+                self.metrics.inc("sessions/recovered")
+                self.logger.debug(f"Session {e} lost, resuming permit {permit} on a new one ({recoveries}/{self.session_recoveries})")
+                await asyncio.sleep(self.backoff(recoveries))
+                continue
+            except BaseException:
+                await self.session_pool.discard(session)
+                raise
+            await self.park_session(session, trackid)
+            if self.flow_control is not None:
+                self.flow_control.success()
+            if not exists:
+                self.logger.info(f"Permit does not exist! {permit}")
+                self.metrics.inc("permits/nonexistent")
+                return None
+            if previous is not None:
+                self.metrics.inc("permits/refreshed")
+            # a run limited to some tabs never replaces an entry, it may carry the other tabs
+            if self.cache is not None and (len(self.grid_tabs) == len(GRID_TABS) or not self.cache.contains(permit)):
+                self.cache.put(item, badges)
+            return item
+
+
+    async def permit_flow(self, session: IntraWebSession, permit: str, item: Dict, previous: Tuple[Dict, Dict] = None) -> Tuple[bool, str, Dict]:
+        """
+        Fills `item` with the selected tabs that are not in it yet and returns whether the permit
+        exists, the trackid to park the session with and the badge counts. `previous` is the
+        last (item, badge counts) snapshot, whose unchanged tabs are reused.
+        """
+        ajax_id = self.get_ajax_id()
+        exists, trackid = await self.submit_permit(session, ajax_id, permit)
+        if not exists:
+            return False, trackid, {}
+
+        # the detail page is fetched on every pass, it is the way to FrmPermitDetail
+        trackid, item["detail"], tabs_status = await self.get_detail_tab(session.session_id, ajax_id, permit, trackid)
+        # get data from the selected tabs, skipping those whose badge shows no rows
+        for tab in self.grid_tabs:
+            if tab.item_key in item:
+                continue
+            if previous is not None and tab.unchanged(*previous, item["detail"], tabs_status):
+                item[tab.item_key] = previous[0][tab.item_key]
+                self.metrics.inc(f"tabs/{tab.name}/unchanged")
+            elif tabs_status.get(tab.badge):
+                trackid, item[tab.item_key] = await self.get_grid_tab(session.session_id, ajax_id, trackid, tab)
+            else:
+                item[tab.item_key] = []
+                self.metrics.inc(f"tabs/{tab.name}/skipped")
+
+        # back to FrmMain so the session can take the next permit
+        try:
+            trackid = await self.go_back(session.session_id, ajax_id, trackid, DETAIL, step="detail_back")
+        except SessionExpired:
+            # the item is complete, only the session is lost
+            return True, None, tabs_status
+        return True, trackid, tabs_status
+
+
+    async def open_session(self) -> IntraWebSession:
+        """
+        Runs the IntraWeb handshake and returns a session parked on FrmMain.
+        """
+        # the landing page is not kept through the rest of the handshake
+        landing = await self.download(scrapy.Request(self.base_url, dont_filter=True), step="landing")
+        session_id, window_id = extract_session_state(landing.body)
+        del landing
         # submit session form
         await self.register_session(session_id, window_id)
         
@@ -38,38 +279,143 @@ class Marionfl(scrapy.Spider):
         await self.click_permit_btn(session_id, ajax_id)
         await self.set_trackid(session_id)
         await self.set_timer(session_id, ajax_id, timer_type="main") # trackid updated to 5
+        return IntraWebSession(session_id, window_id, trackid="5")
 
-        # submit permit
-        ajax_id = self.get_ajax_id()
-        trackid = await self.submit_permit(session_id, ajax_id, permit)
+
+    async def park_session(self, session: IntraWebSession, trackid: str) -> None:
+        """
+        Hands a session that is back on FrmMain to the pool, or drops it if we lost its trackid.
+        """
         if trackid is None:
-            self.logger.info(f"Permit does not exist! {permit}")
-            return None
-
-        # get data from available tabs
-        trackid, detail_item, tabs_status = await self.get_detail_tab(session_id, ajax_id, permit, trackid, callback=self.parse_detail_tab) 
-        trackid, inspection_item = await self.get_inspection_tab(session_id, ajax_id, trackid, callback=self.parse_tab) if tabs_status.get('inspection') else (trackid, [])
-        trackid, review_item = await self.get_review_tab(session_id, ajax_id, trackid, callback=self.parse_tab) if tabs_status.get('review') else (trackid, [])
-        trackid, permit_holds_item = await self.get_permit_holds_tab(session_id, ajax_id, trackid, callback=self.parse_tab) if tabs_status.get('permit_hold') else (trackid, [])
-        trackid, fees_item = await self.get_fees_tab(session_id, ajax_id, trackid, callback=self.parse_tab) if tabs_status.get('fees') else (trackid, [])
-        trackid, subs_item = await self.get_subs_tab(session_id, ajax_id, trackid, callback=self.parse_tab) if tabs_status.get('subs') else (trackid, [])
-        trackid, cos_item = await self.get_cos_tab(session_id, ajax_id, trackid, callback=self.parse_tab) if tabs_status.get('cos') else (trackid, [])
-
-        item = dict(
-            permit=permit,
-            detail=detail_item,
-            inspection=inspection_item,
-            reviews=review_item,
-            permit_holds=permit_holds_item,
-            fees=fees_item,
-            subs=subs_item,
-            cos=cos_item
-        )
-        return item
-    
+            await self.session_pool.discard(session)
+            return
+        session.trackid = trackid
+        await self.session_pool.release(session)
+
+
+    async def download(self, request: scrapy.Request, step: str) -> Response:
+        """
+        Sends one step of the session chain straight to the downloader, tagged with its step name.
+        With `HTTP_ENGINE = "asyncio"` it goes out on the spider's own keep-alive client instead.
+        Network errors and `RETRY_HTTP_CODES` responses are retried here with exponential backoff,
+        up to `STEP_RETRY_TIMES` times, instead of by the retry middleware.
+        """
+        request.meta["step"] = step
+        request.meta["dont_retry"] = True
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                if self.http_client is None:
+                    d = self.crawler.engine.download(request)
+                    response = await maybe_deferred_to_future(d)
+                else:
+                    response = await self.fetch(request)
+            except Exception as e:
+                self.metrics.inc(f"steps/{step}/failures")
+                if self.flow_control is not None:
+                    self.flow_control.failure()
+                if isinstance(e, IgnoreRequest) or attempt >= self.step_retry_times:
+                    raise
+                self.logger.debug(f"Step {step} failed with {e!r}, retrying")
+            else:
+                elapsed = time.perf_counter() - started
+                self.metrics.observe_request(step, elapsed, len(response.body))
+                if self.flow_control is not None:
+                    # the server's share of the step, our own event loop lag is no reason to back off
+                    self.flow_control.observe_latency(response.meta.get("download_latency", elapsed))
+                if response.status not in self.step_retry_codes:
+                    return response
+                if self.flow_control is not None:
+                    self.flow_control.failure()
+                if attempt >= self.step_retry_times:
+                    return response
+                self.logger.debug(f"Step {step} got HTTP {response.status}, retrying")
+            attempt += 1
+            self.metrics.inc(f"steps/{step}/retries")
+            await asyncio.sleep(self.backoff(attempt))
+            request = request.copy()
+
+
+    async def fetch(self, request: scrapy.Request) -> Response:
+        """
+        Sends `request` on the spider's HTTP client, skipping Scrapy's scheduler, downloader
+        middlewares and slots. The chain never reorders, so none of that buys anything here.
+        Downloader middlewares such as the cassette recorder do not see these requests.
+        """
+        headers = dict(self.request_headers)
+        for name, values in request.headers.items():
+            headers[name.decode("latin-1")] = b", ".join(values).decode("latin-1")
+        started = time.perf_counter()
+        status, response_headers, body = await self.http_client.request(request.method, request.url, list(headers.items()), request.body)
+        request.meta["download_latency"] = time.perf_counter() - started
+        response_headers = Headers(response_headers)
+        cls = responsetypes.from_args(headers=response_headers, url=request.url, body=body)
+        return cls(request.url, status=status, headers=response_headers, body=body, request=request)
+
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter, so sessions that failed together do not retry together
+        return random.uniform(0, min(self.step_retry_backoff_max, self.step_retry_backoff * 2 ** (attempt - 1)))
+
+
+    def is_dead_session(self, response: Response) -> bool:
+        if response.status != 200:
+            return True
+        body = response.body.lower()
+        return any(marker in body for marker in self.dead_session_markers)
+
+
+    def is_start_form(self, response: Response) -> bool:
+        # only the callback's script counts, pages that merely mention FrmStart do not
+        script = extract_script(response.body).lower()
+        return any(marker in script for marker in self.start_form_markers)
+
+
+    def next_trackid(self, response: Response, session_id: str, step: str) -> str:
+        """
+        Trackid for the next callback. An expired-session page, a callback whose script switches to FrmStart
+        or one without a trackid means the session is gone or out of sync.
+        """
+        if not self.is_dead_session(response) and not self.is_start_form(response):
+            trackid = extract_trackid(response.body)
+            if trackid is not None:
+                return trackid
+        raise SessionExpired(f"{session_id} at {step}")
+
+
+    def item_scraped(self, item: Dict, response: Response, spider: scrapy.Spider) -> None:
+        self.ledger.record(item["permit"], SCRAPED)
+
+
+    def closed(self, reason: str) -> None:
+        self.metrics.stop()
+        if self.http_client is not None:
+            self.http_client.close()
+            self.logger.info(f"HTTP client: {self.http_client.opened} connections opened")
+        self.logger.info(f"Session pool: {self.session_pool.opened} sessions opened, {self.session_pool.reused} reuses")
+        if self.flow_control is not None:
+            self.crawler.stats.set_value("flow_control/limit", round(self.flow_control.limit, 2))
+            self.crawler.stats.set_value("flow_control/peak", round(self.flow_control.peak, 2))
+            self.crawler.stats.set_value("flow_control/decreases", self.flow_control.decreases)
+            self.logger.info(f"Flow control: limit {self.flow_control.limit:.1f}, peak {self.flow_control.peak:.1f}, {self.flow_control.decreases} decreases")
+        if self.ledger is not None:
+            self.logger.info(f"Ledger: {self.ledger.counts()}")
+            failed = self.ledger.permits(FAILED)
+            if failed:
+                self.logger.warning(f"{len(failed)} permits failed, the next run retries them: {', '.join(failed[:20])}")
+            if reason == "finished":
+                # the ledger resumes an interrupted run, the next full run goes through the cache again;
+                # failed permits stay so their attempts keep counting
+                self.ledger.clear()
+            self.ledger.close()
+        if self.cache is not None:
+            self.cache.close()
+            self.logger.info(f"Permit cache: {self.cache.evicted} evicted")
+
 
     async def register_session(self, session_id: str, window_id: str) -> None:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/"
+        url = f"{self.base_url}/{session_id}/"
         data = {
             'IW_width': '728',
             'IW_height': '797',
@@ -78,8 +424,7 @@ class Marionfl(scrapy.Spider):
             'IW_TrackID_': '1',
             'IW_WindowID_': window_id,
         }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
+        response = await self.download(scrapy.FormRequest(url, formdata=data), step="register_session")
         return
 
 
@@ -93,14 +438,13 @@ class Marionfl(scrapy.Spider):
             'IW_FormName': 'FrmStart' if timer_type is None else "FrmMain",
             'IW_AjaxID': ajax_id,
         }
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?"+urlencode(params)
-        d = self.crawler.engine.download(scrapy.Request(url=url))
-        response = await maybe_deferred_to_future(d)
+        url = f"{self.base_url}/{session_id}/$/callback?"+urlencode(params)
+        response = await self.download(scrapy.Request(url=url), step="set_timer")
         return
 
 
     async def click_permit_btn(self, session_id: str, ajax_id: str) -> None:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=BTNPERMITS.DoOnAsyncClick&x=161&y=23&which=0&modifiers="
+        url = f"{self.base_url}/{session_id}/$/callback?callback=BTNPERMITS.DoOnAsyncClick&x=161&y=23&which=0&modifiers="
         data = {
             'BTNPERMITS': '',
             'IW_FormName': 'FrmStart',
@@ -115,24 +459,22 @@ class Marionfl(scrapy.Spider):
             'IW_WindowID_': 'I1',
             'IW_AjaxID': ajax_id,
         }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
+        response = await self.download(scrapy.FormRequest(url, formdata=data), step="click_permit_btn")
         return
 
 
     async def set_trackid(self, session_id: str) -> None:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/"
+        url = f"{self.base_url}/{session_id}/"
         data = {
             'IW_SessionID_': session_id,
             'IW_TrackID_': '3',
         }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
+        response = await self.download(scrapy.FormRequest(url, formdata=data), step="set_trackid")
         return 
 
 
-    async def submit_permit(self, session_id: str, ajax_id: str, permit: str) -> str:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=EDTPERMITNBR.DoOnAsyncKeyUp&which=0&modifiers="
+    async def submit_permit(self, session: IntraWebSession, ajax_id: str, permit: str) -> Tuple[bool, Optional[str]]:
+        url = f"{self.base_url}/{session.session_id}/$/callback?callback=EDTPERMITNBR.DoOnAsyncKeyUp&which=0&modifiers="
         data = {
             'EDTPERMITNBR': permit,
             'IW_FormName': 'FrmMain',
@@ -142,269 +484,72 @@ class Marionfl(scrapy.Spider):
             'IW_Action': 'EDTPERMITNBR',
             'IW_ActionParam': '',
             'IW_Offset': '',
-            'IW_SessionID_': session_id,
-            'IW_TrackID_': '5',
+            'IW_SessionID_': session.session_id,
+            'IW_TrackID_': session.trackid,
             'IW_WindowID_': 'I1',
             'IW_AjaxID': ajax_id,
         }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        if 'no matching permit' in response.text.lower():
-            return None
-        return response.xpath("//trackid/text()").get()
-    
-
-    async def get_tab(self, session_id: str, trackid: str, callback=callable, return_iframe: bool = False) -> Dict | Tuple[Dict, Response]:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/"
-        data = {
-            'IW_SessionID_': session_id,
-            'IW_TrackID_': trackid,
-        }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        if return_iframe:
-            return callback(response), response
-        return callback(response)
+        response = await self.download(scrapy.FormRequest(url, formdata=data), step="submit_permit")
+        if response.status == 200 and b'no matching permit' in response.body.lower():
+            # the permit is settled even without a trackid, the session is then dropped when parked
+            return False, extract_trackid(response.body)
+        return True, self.next_trackid(response, session.session_id, "submit_permit")
     
 
-    async def go_back(self, session_id: str, ajax_id: str, trackid: str, formname: str, formclass: str):
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=IMGBACK.DoOnAsyncClick&x=46&y=21&which=0&modifiers="
-        data = {
-            'IW_FormName': formname,
-            'IW_FormClass': formclass,
-            'IW_width': '728',
-            'IW_height': '797',
-            'IW_Action': 'IMGBACK',
-            'IW_ActionParam': '',
-            'IW_Offset': '',
-            'IW_SessionID_': session_id,
-            'IW_TrackID_': trackid,
-            'IW_WindowID_': 'I1',
-            'IW_AjaxID': ajax_id,
-        }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        trackid = response.xpath("//trackid/text()").get() or response.xpath("//*").re_first(r'"IW_TrackID_": (\d+)')
-        return trackid
-
-
-    async def get_detail_tab(self, session_id: str, ajax_id: str, permit: str, trackid: str, callback: callable) -> Tuple[str, Dict, Dict]:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=BTNGUESTLOGIN.DoOnAsyncClick&x=118&y=29&which=0&modifiers="
-        data = {
-            'EDTPERMITNBR': permit,
-            'BTNGUESTLOGIN': '',
-            'IW_FormName': 'FrmMain',
-            'IW_FormClass': 'TFrmMain',
-            'IW_width': '728',
-            'IW_height': '797',
-            'IW_Action': 'BTNGUESTLOGIN',
-            'IW_ActionParam': '',
-            'IW_Offset': '',
-            'IW_SessionID_': session_id,
-            'IW_TrackID_': trackid,
-            'IW_WindowID_': 'I1',
-            'IW_AjaxID': ajax_id,
-        }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        trackid = response.xpath("//trackid/text()").get() or response.xpath("//*").re_first(r'"IW_TrackID_": (\d+)')
-        item, iframe = await self.get_tab(session_id, trackid, callback=callback, return_iframe=True)
-        other_tabs = self.get_tabs_status(iframe)
-        return trackid, item, other_tabs
-
-
-    async def get_inspection_tab(self, session_id: str, ajax_id: str, trackid: str, callback=callable) -> Tuple[str, Dict]:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=BTNVIEWINSPECTIONS.DoOnAsyncClick&x=42&y=14&which=0&modifiers="
+    async def get_tab(self, session_id: str, trackid: str, callback=callable, badges: bool = False, step: str = "tab") -> Dict | Tuple[Dict, Dict]:
+        """
+        Fetches and parses the current iframe. Only the parsed item (and with `badges`, the tab
+        badge counts) leaves here, the page and its parsed tree are dropped with the response.
+        """
+        url = f"{self.base_url}/{session_id}/"
         data = {
-            'BTNVIEWINSPECTIONS': '',
-            'IW_FormName': 'FrmPermitDetail',
-            'IW_FormClass': 'TFrmPermitDetail',
-            'IW_width': '728',
-            'IW_height': '797',
-            'IW_Action': 'BTNVIEWINSPECTIONS',
-            'IW_ActionParam': '',
-            'IW_Offset': '',
             'IW_SessionID_': session_id,
             'IW_TrackID_': trackid,
-            'IW_WindowID_': 'I1',
-            'IW_AjaxID': ajax_id,
         }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        trackid = response.xpath("//trackid/text()").get() or response.xpath("//*").re_first(r'"IW_TrackID_": (\d+)')
-        item = await self.get_tab(session_id, trackid, callback=callback)
-        trackid = await self.go_back(session_id, ajax_id, trackid, "FrmPermitInspections", "TFrmPermitInspections")
-        return trackid, item
+        response = await self.download(scrapy.FormRequest(url, formdata=data), step=step)
+        if self.is_dead_session(response):
+            raise SessionExpired(f"{session_id} at {step}")
+        started = time.perf_counter()
+        item = callback(response)
+        self.metrics.observe_parse(step, time.perf_counter() - started)
+        if not item:
+            self.metrics.inc(f"tabs/{step}/empty")
+        if badges:
+            started = time.perf_counter()
+            tabs_status = self.get_tabs_status(response)
+            self.metrics.observe_parse("detail_badges", time.perf_counter() - started)
+            return item, tabs_status
+        return item
     
 
-    async def get_review_tab(self, session_id: str, ajax_id: str, trackid: str, callback=callable) -> Tuple[str, Dict]:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=BTNVIEWPLANREVIEWS.DoOnAsyncClick&x=36&y=19&which=0&modifiers="
-        data = {
-            'BTNVIEWPLANREVIEWS': '',
-            'IW_FormName': 'FrmPermitDetail',
-            'IW_FormClass': 'TFrmPermitDetail',
-            'IW_width': '728',
-            'IW_height': '797',
-            'IW_Action': 'BTNVIEWPLANREVIEWS',
-            'IW_ActionParam': '',
-            'IW_Offset': '',
-            'IW_SessionID_': session_id,
-            'IW_TrackID_': trackid,
-            'IW_WindowID_': 'I1',
-            'IW_AjaxID': ajax_id,
-        }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        trackid = response.xpath("//trackid/text()").get() or response.xpath("//*").re_first(r'"IW_TrackID_": (\d+)')
-        item = await self.get_tab(session_id, trackid, callback=callback)
-        trackid = await self.go_back(session_id, ajax_id, trackid, "FrmPlanReviews", "TFrmPlanReviews")
-        return trackid, item
-
-
-    async def get_permit_holds_tab(self, session_id: str, ajax_id: str, trackid: str, callback=callable) -> Tuple[str, Dict]:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=BTNPERMITHOLDS.DoOnAsyncClick&x=58&y=17&which=0&modifiers="
-        data = {
-            'BTNPERMITHOLDS': '',
-            'IW_FormName': 'FrmPermitDetail',
-            'IW_FormClass': 'TFrmPermitDetail',
-            'IW_width': '728',
-            'IW_height': '797',
-            'IW_Action': 'BTNPERMITHOLDS',
-            'IW_ActionParam': '',
-            'IW_Offset': '',
-            'IW_SessionID_': session_id,
-            'IW_TrackID_': trackid,
-            'IW_WindowID_': 'I1',
-            'IW_AjaxID': ajax_id,
-        }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        trackid = response.xpath("//trackid/text()").get() or response.xpath("//*").re_first(r'"IW_TrackID_": (\d+)')
-        item = await self.get_tab(session_id, trackid, callback=callback)
-        trackid = await self.go_back(session_id, ajax_id, trackid, "FrmComments", "TFrmComments")
-        return trackid, item
-
+    async def go_back(self, session_id: str, ajax_id: str, trackid: str, tab: Tab, step: str = "go_back") -> str:
+        request = tab.back.request(self.base_url, session_id, trackid, ajax_id)
+        response = await self.download(request, step=step)
+        return self.next_trackid(response, session_id, step)
 
-    async def get_fees_tab(self, session_id: str, ajax_id: str, trackid: str, callback=callable) -> Tuple[str, Dict]:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=BTNVIEWFEES.DoOnAsyncClick&x=60&y=19&which=0&modifiers="
-        data = {
-            'BTNVIEWFEES': '',
-            'IW_FormName': 'FrmPermitDetail',
-            'IW_FormClass': 'TFrmPermitDetail',
-            'IW_width': '728',
-            'IW_height': '797',
-            'IW_Action': 'BTNVIEWFEES',
-            'IW_ActionParam': '',
-            'IW_Offset': '',
-            'IW_SessionID_': session_id,
-            'IW_TrackID_': trackid,
-            'IW_WindowID_': 'I1',
-            'IW_AjaxID': ajax_id,
-        }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        trackid = response.xpath("//trackid/text()").get() or response.xpath("//*").re_first(r'"IW_TrackID_": (\d+)')
-        item = await self.get_tab(session_id, trackid, callback=callback)
-        trackid = await self.go_back(session_id, ajax_id, trackid, "FrmFees", "TFrmFees")
-        return trackid, item
-    
 
-    async def get_subs_tab(self, session_id: str, ajax_id: str, trackid: str, callback=callable) -> Tuple[str, Dict]:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=BTNSUBS.DoOnAsyncClick&x=26&y=22&which=0&modifiers="
-        data = {
-            'BTNSUBS': '',
-            'IW_FormName': 'FrmPermitDetail',
-            'IW_FormClass': 'TFrmPermitDetail',
-            'IW_width': '728',
-            'IW_height': '797',
-            'IW_Action': 'BTNSUBS',
-            'IW_ActionParam': '',
-            'IW_Offset': '',
-            'IW_SessionID_': session_id,
-            'IW_TrackID_': trackid,
-            'IW_WindowID_': 'I1',
-            'IW_AjaxID': ajax_id,
-        }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        trackid = response.xpath("//trackid/text()").get() or response.xpath("//*").re_first(r'"IW_TrackID_": (\d+)')
-        item = await self.get_tab(session_id, trackid, callback=callback)
-        trackid = await self.go_back(session_id, ajax_id, trackid, "FrmSubContractors", "TFrmSubContractors")
-        return trackid, item
+    async def get_detail_tab(self, session_id: str, ajax_id: str, permit: str, trackid: str) -> Tuple[str, Dict, Dict]:
+        request = DETAIL.click.request(self.base_url, session_id, trackid, ajax_id, prefix=urlencode({'EDTPERMITNBR': permit}))
+        trackid = self.next_trackid(await self.download(request, step="detail_click"), session_id, "detail_click")
+        item, tabs_status = await self.get_tab(session_id, trackid, callback=DETAIL.parser, badges=True, step=DETAIL.name)
+        return trackid, item, tabs_status
 
 
-    async def get_cos_tab(self, session_id: str, ajax_id: str, trackid: str, callback=callable) -> Tuple[str, Dict]:
-        url = f"https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll/{session_id}/$/callback?callback=BTNVIEWCOS.DoOnAsyncClick&x=24&y=16&which=0&modifiers="
-        data = {
-            'BTNVIEWCOS': '',
-            'IW_FormName': 'FrmPermitDetail',
-            'IW_FormClass': 'TFrmPermitDetail',
-            'IW_width': '728',
-            'IW_height': '797',
-            'IW_Action': 'BTNVIEWCOS',
-            'IW_ActionParam': '',
-            'IW_Offset': '',
-            'IW_SessionID_': session_id,
-            'IW_TrackID_': trackid,
-            'IW_WindowID_': 'I1',
-            'IW_AjaxID': ajax_id,
-        }
-        d = self.crawler.engine.download(scrapy.FormRequest(url, formdata=data))
-        response = await maybe_deferred_to_future(d)
-        trackid = response.xpath("//trackid/text()").get() or response.xpath("//*").re_first(r'"IW_TrackID_": (\d+)')
-        item = await self.get_tab(session_id, trackid, callback=callback)
-        trackid = await self.go_back(session_id, ajax_id, trackid, "FrmCertOcc", "TFrmCertOcc")
+    async def get_grid_tab(self, session_id: str, ajax_id: str, trackid: str, tab: Tab) -> Tuple[str, Dict]:
+        """
+        Opens one grid tab from FrmPermitDetail, parses it and goes back: click, fetch, back.
+        """
+        step = f"{tab.name}_click"
+        # only the trackid of a click response is kept, not the response, across the awaits below
+        trackid = self.next_trackid(await self.download(tab.click.request(self.base_url, session_id, trackid, ajax_id), step=step), session_id, step)
+        item = await self.get_tab(session_id, trackid, callback=tab.parser, step=tab.name)
+        trackid = await self.go_back(session_id, ajax_id, trackid, tab, step=f"{tab.name}_back")
         return trackid, item
 
 
-    @staticmethod
-    def parse_detail_tab(response: Response) -> Dict:
-        item = dict(
-            permit_status=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT2']/@value").get(),
-            type=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT12']/@value").get('') + ', ' + response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT3']/@value").get(''),
-            owner=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT4']/@value").get(),
-            address=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT5']/@value").get(),
-            parcel=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT14']/@value").get(),
-            dba=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT6']/@value").get(),
-            job_desc=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBMEMO1'] | //input[@id='BTNPRINTJOBCARD']/parent::form/textarea/text()").get(),
-            apply_date=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT13']/@value").get(),
-            issued_date=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT8']/@value").get(),
-            co_date=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT7']/@value").get(),
-            expiration_date=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT9']/@value").get(),
-            last_inspection_request=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT10']/@value").get(),
-            last_inspection_result=response.xpath("//input[@id='BTNPRINTJOBCARD']/parent::form/input[@id='IWDBEDIT11']/@value").get(),
-        )
-        return {k:v.strip() if isinstance(v, str) else v for k,v in item.items()}
-
-
-    @staticmethod
-    def parse_tab(response: Response) -> Dict:
-        headers = response.xpath("//td[@onclick]//table[contains(@id,'GRID_')]/tr[1]/td//b/span/text()").getall()
-        item = []
-        for row in response.xpath("//td[@onclick]//table[contains(@id,'GRID_')]/tr")[1:]:
-            row_item = {}
-            for header, value in zip(headers, row.xpath("./td//div/text()").getall()):
-                if value.strip():
-                    row_item[header] = value
-            if row_item:
-                row_item = {k:v.strip() if isinstance(v, str) else v for k,v in row_item.items()}
-                item.append(row_item)
-        return item
-
-
     @staticmethod
     def get_tabs_status(response: Response) -> Dict:
-        statuses = re.findall("\.attr\('data-badge','(\d+)'\)", response.xpath("//script[@nonce][2]").get(''))
-        if statuses and len(statuses) == 6:
-            return {
-                "review": int(statuses[0] or 0),
-                "fees": int(statuses[1] or 0),
-                "inspection": int(statuses[2] or 0),
-                "subs": int(statuses[3] or 0),
-                "cos": int(statuses[4] or 0),
-                "permit_hold": int(statuses[5] or 0),
-            }
-        return {}
+        return parse_tabs_status(response)
     
 
     @staticmethod
@@ -421,10 +566,16 @@ class Marionfl(scrapy.Spider):
 ########################################
 
 
-crawler = CrawlerProcess(settings=dict(
-    CONCURRENT_REQUESTS=4,
+SETTINGS = dict(
+    # permit flows are limited by the flow controller, up to SESSION_POOL_SIZE sessions
+    CONCURRENT_REQUESTS=16,
+    CONCURRENT_REQUESTS_PER_DOMAIN=8,
+    SESSION_POOL_SIZE=8,
+    FLOW_CONTROL_INITIAL=4,
     TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor",
-    FEEDS={"sample.json": {"format": "json"}},
+    FEEDS={"sample.jsonl": {"format": "jsonlines"}},
+    LEDGER_PATH="ledger.sqlite",
+    PERMIT_CACHE_PATH="cache.sqlite",
     COOKIES_ENABLED=False,
     DEFAULT_REQUEST_HEADERS={
         'Host': 'cdplusmobile.marioncountyfl.org',
@@ -432,7 +583,31 @@ crawler = CrawlerProcess(settings=dict(
         'Accept': '*/*',
         'Referer': 'https://cdplusmobile.marioncountyfl.org/pdswebservices/PROD/webpermitnew/webpermits.dll',
         'Accept-Language': 'en-US,en;q=0.9,ur;q=0.8,af;q=0.7',
-    }
-))
-crawler.crawl(Marionfl)
-crawler.start()
\ No newline at end of file
+    },
+    DOWNLOADER_MIDDLEWARES={"cassette.CassetteRecorderMiddleware": 580},
+    # streams items to rotated gzip partitions once PARTITION_DIR is set
+    ITEM_PIPELINES={"pipelines.PartitionedJsonlPipeline": 300},
+)
+
+
+def run(settings: Dict = None, stats_path: str = None, spider_cls: type = None, **spider_kwargs) -> Dict:
+    """
+    Runs one crawl in this process with `SETTINGS` plus `settings` overrides and returns its stats.
+    Overrides take precedence over the spider's `custom_settings`, like `-s` on the command line.
+    Spider arguments (`permits`, `shard`, `limit`, ...) are passed through as keywords.
+    """
+    process_settings = Settings(SETTINGS)
+    process_settings.setdict(settings or {}, priority="cmdline")
+    process = CrawlerProcess(settings=process_settings)
+    crawler = process.create_crawler(spider_cls or Marionfl)
+    process.crawl(crawler, **spider_kwargs)
+    process.start()
+    stats = crawler.stats.get_stats()
+    if stats_path:
+        with open(stats_path, "w") as f:
+            json.dump(stats, f, indent=4, default=str)
+    return stats
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,158 @@
+"""
+Runs the crawl across several worker processes, one reactor and one permit shard each.
+
+    python supervisor.py --workers 4 --permits permits.json --output output/ [--sessions 16] [-s NAME=VALUE] [-a NAME=VALUE]
+
+Worker i crawls shard i/N into `output/worker-i.jsonl` with its own ledger (`output/ledger-i.sqlite`),
+log and stats file. The `--sessions` ceiling (by default the spider's own `SESSION_POOL_SIZE`) is
+split evenly across workers, and there are never more workers than sessions. A worker that dies
+is restarted (up to --max-restarts) and resumes from its ledger. When every worker is done the feeds are merged into `output/items.jsonl` and the stats
+into `output/stats.json`.
+"""
+import argparse
+from datetime import datetime
+import json
+import logging
+import multiprocessing
+from pathlib import Path
+import time
+from typing import Dict, List
+
+
+logger = logging.getLogger("supervisor")
+
+
+def worker_main(index: int, count: int, output: str, permits: str, settings: Dict, spider_kwargs: Dict) -> None:
+    from spider import run
+
+    output = Path(output)
+    if settings.get("METRICS_EXPORT_PATH"):
+        # one snapshot file per worker, e.g. metrics-0.prom
+        path = Path(settings["METRICS_EXPORT_PATH"])
+        settings = dict(settings, METRICS_EXPORT_PATH=str(path.with_name(f"{path.stem}-{index}{path.suffix}")))
+    overrides = {
+        "FEEDS": {str(output / f"worker-{index}.jsonl"): {"format": "jsonlines"}},
+        "LEDGER_PATH": str(output / f"ledger-{index}.sqlite"),
+        "LOG_FILE": str(output / f"worker-{index}.log"),
+        **settings,
+    }
+    stats = run(overrides, stats_path=str(output / f"stats-{index}.json"), permits=permits, shard=f"{index}/{count}", **spider_kwargs)
+    raise SystemExit(0 if stats.get("finish_reason") == "finished" else 1)
+
+
+def merge_feeds(output: Path, count: int) -> int:
+    """
+    Concatenates the worker feeds. A restarted worker can repeat permits whose ledger batch
+    was lost, so each worker's feed keeps only the last record per permit.
+    """
+    written = 0
+    with open(output / "items.jsonl", "w") as out:
+        for index in range(count):
+            path = output / f"worker-{index}.jsonl"
+            if not path.exists():
+                continue
+            last = {}
+            with open(path, "r") as f:
+                for offset, line in enumerate(f):
+                    last[json.loads(line)["permit"]] = offset
+            keep = set(last.values())
+            with open(path, "r") as f:
+                for offset, line in enumerate(f):
+                    if offset in keep:
+                        out.write(line)
+                        written += 1
+    return written
+
+
+def merge_stats(output: Path, count: int, restarts: List[int]) -> Dict:
+    workers = {}
+    for index in range(count):
+        path = output / f"stats-{index}.json"
+        if path.exists():
+            with open(path, "r") as f:
+                workers[index] = json.load(f)
+    total = {}
+    for stats in workers.values():
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total[key] = total.get(key, 0) + value
+    total["supervisor/restarts"] = sum(restarts)
+    merged = dict(total=total, workers=workers)
+    with open(output / "stats.json", "w") as f:
+        json.dump(merged, f, indent=4, default=str)
+    return merged
+
+
+def supervise(count: int, output: Path, permits: str, settings: Dict, spider_kwargs: Dict, max_restarts: int = 3) -> bool:
+    context = multiprocessing.get_context("spawn")
+    restarts = [0] * count
+
+    def start(index: int):
+        process = context.Process(target=worker_main, args=(index, count, str(output), permits, settings, spider_kwargs), name=f"worker-{index}")
+        process.start()
+        return process
+
+    running = {index: start(index) for index in range(count)}
+    failed = set()
+    try:
+        while running:
+            time.sleep(1)
+            for index, process in list(running.items()):
+                if process.is_alive():
+                    continue
+                del running[index]
+                if process.exitcode == 0:
+                    logger.info(f"Worker {index} finished")
+                elif restarts[index] < max_restarts:
+                    restarts[index] += 1
+                    logger.warning(f"Worker {index} exited with {process.exitcode}, restart {restarts[index]}/{max_restarts}")
+                    running[index] = start(index)
+                else:
+                    logger.error(f"Worker {index} exited with {process.exitcode}, giving up")
+                    failed.add(index)
+    except KeyboardInterrupt:
+        for process in running.values():
+            process.terminate()
+        for process in running.values():
+            process.join()
+        raise
+
+    items = merge_feeds(output, count)
+    stats = merge_stats(output, count, restarts)["total"]
+    logger.info(f"Merged {items} items, {stats.get('downloader/request_count', 0)} requests, {sum(restarts)} restarts")
+    return not failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--permits", default="permits.json")
+    parser.add_argument("--output", type=Path, default=Path("output") / datetime.now().strftime("%Y%m%d-%H%M%S"))
+    parser.add_argument("--sessions", type=int, help="ceiling on IntraWeb sessions across all workers, by default the single-process SESSION_POOL_SIZE")
+    parser.add_argument("--max-restarts", type=int, default=3)
+    parser.add_argument("-s", "--set", action="append", default=[], metavar="NAME=VALUE", help="Scrapy setting for every worker")
+    parser.add_argument("-a", "--arg", action="append", default=[], metavar="NAME=VALUE", help="spider argument for every worker")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
+
+    from spider import SETTINGS
+
+    settings = dict(item.split("=", 1) for item in args.set)
+    # the ceiling is shared, so more workers never means more sessions on the county server
+    sessions = args.sessions or SETTINGS["SESSION_POOL_SIZE"]
+    if sessions < 1:
+        parser.error("--sessions must be at least 1")
+    if args.workers > sessions:
+        logger.warning(f"{args.workers} workers for {sessions} sessions, running {sessions} workers")
+        args.workers = sessions
+    per_worker = sessions // args.workers
+    settings.update(SESSION_POOL_SIZE=per_worker, CONCURRENT_REQUESTS=2 * per_worker, CONCURRENT_REQUESTS_PER_DOMAIN=per_worker)
+    spider_kwargs = dict(item.split("=", 1) for item in args.arg)
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    ok = supervise(args.workers, args.output, args.permits, settings, spider_kwargs, args.max_restarts)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
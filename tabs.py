@@ -0,0 +1,122 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Tuple
+from urllib.parse import urlencode
+
+import scrapy
+
+from parsers import parse_detail, parse_grid
+
+
+
+@dataclass(frozen=True)
+class CallbackTemplate:
+    """
+    An IntraWeb ajax callback with its query string and static form fields encoded once.
+    Only the session, trackid and ajax id are filled in per request.
+    """
+    path: str
+    body: str
+
+    @classmethod
+    def build(cls, action: str, x: int, y: int, form_name: str, button: bool = True) -> "CallbackTemplate":
+        fields = [(action, '')] if button else []
+        fields += [
+            ('IW_FormName', form_name),
+            ('IW_FormClass', 'T' + form_name),
+            ('IW_width', '728'),
+            ('IW_height', '797'),
+            ('IW_Action', action),
+            ('IW_ActionParam', ''),
+            ('IW_Offset', ''),
+        ]
+        return cls(f"$/callback?callback={action}.DoOnAsyncClick&x={x}&y={y}&which=0&modifiers=", urlencode(fields))
+
+
+    def request(self, base_url: str, session_id: str, trackid: str, ajax_id: str, prefix: str = None) -> scrapy.Request:
+        body = self.body + '&' + urlencode((('IW_SessionID_', session_id), ('IW_TrackID_', trackid), ('IW_WindowID_', 'I1'), ('IW_AjaxID', ajax_id)))
+        if prefix:
+            body = prefix + '&' + body
+        return scrapy.Request(
+            f"{base_url}/{session_id}/{self.path}",
+            method="POST",
+            body=body,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+
+
+
+@dataclass(frozen=True)
+class Tab:
+    name: str
+    item_key: str
+    badge: str
+    click: CallbackTemplate
+    back: CallbackTemplate
+    parser: Callable
+    # detail fields that move when the tab's rows change without changing their count
+    watch: Tuple[str, ...] = ()
+
+
+    def unchanged(self, previous: Dict, previous_badges: Dict, detail: Dict, badges: Dict) -> bool:
+        """
+        Whether the rows scraped last time can be reused: same badge count, same permit status
+        and same watched detail fields.
+        """
+        if self.item_key not in previous or self.badge not in badges:
+            return False
+        if badges[self.badge] != previous_badges.get(self.badge):
+            return False
+        before = previous.get("detail") or {}
+        return all(before.get(field) == detail.get(field) for field in ("permit_status",) + self.watch)
+
+
+
+DETAIL = Tab(
+    "detail", "detail", None,
+    CallbackTemplate.build("BTNGUESTLOGIN", 118, 29, "FrmMain"),
+    CallbackTemplate.build("IMGBACK", 46, 21, "FrmPermitDetail", button=False),
+    parse_detail,
+)
+
+GRID_TABS = (
+    Tab("inspection", "inspection", "inspection",
+        CallbackTemplate.build("BTNVIEWINSPECTIONS", 42, 14, "FrmPermitDetail"),
+        CallbackTemplate.build("IMGBACK", 46, 21, "FrmPermitInspections", button=False),
+        parse_grid, watch=("last_inspection_request", "last_inspection_result")),
+    Tab("review", "reviews", "review",
+        CallbackTemplate.build("BTNVIEWPLANREVIEWS", 36, 19, "FrmPermitDetail"),
+        CallbackTemplate.build("IMGBACK", 46, 21, "FrmPlanReviews", button=False),
+        parse_grid),
+    Tab("permit_holds", "permit_holds", "permit_hold",
+        CallbackTemplate.build("BTNPERMITHOLDS", 58, 17, "FrmPermitDetail"),
+        CallbackTemplate.build("IMGBACK", 46, 21, "FrmComments", button=False),
+        parse_grid),
+    Tab("fees", "fees", "fees",
+        CallbackTemplate.build("BTNVIEWFEES", 60, 19, "FrmPermitDetail"),
+        CallbackTemplate.build("IMGBACK", 46, 21, "FrmFees", button=False),
+        parse_grid),
+    Tab("subs", "subs", "subs",
+        CallbackTemplate.build("BTNSUBS", 26, 22, "FrmPermitDetail"),
+        CallbackTemplate.build("IMGBACK", 46, 21, "FrmSubContractors", button=False),
+        parse_grid),
+    Tab("cos", "cos", "cos",
+        CallbackTemplate.build("BTNVIEWCOS", 24, 16, "FrmPermitDetail"),
+        CallbackTemplate.build("IMGBACK", 46, 21, "FrmCertOcc", button=False),
+        parse_grid, watch=("co_date",)),
+)
+
+
+def select_tabs(names: str | Iterable[str] = None) -> Tuple[Tab, ...]:
+    """
+    Grid tabs to fetch for `-a tabs=detail,inspection`, in site order. Tabs may be named by
+    tab or item key; the detail tab is always fetched since it carries the badge counts.
+    """
+    if not names:
+        return GRID_TABS
+    if isinstance(names, str):
+        names = names.split(",")
+    wanted = {name.strip() for name in names if name.strip()}
+    unknown = wanted - {DETAIL.name} - {t.name for t in GRID_TABS} - {t.item_key for t in GRID_TABS}
+    if unknown:
+        raise ValueError(f"Unknown tabs: {', '.join(sorted(unknown))}")
+    return tuple(t for t in GRID_TABS if t.name in wanted or t.item_key in wanted)
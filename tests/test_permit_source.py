@@ -0,0 +1,33 @@
+import io
+import json
+
+import pytest
+
+import permit_source
+from permit_source import iter_json_array
+
+
+VALUES = [1500.0, -2.5e-3, 12345678, "2024-ABC-0001", True, None, {"permit": "2024-1", "n": [1.25, 3]}, [10, 0.5]]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 1 << 16])
+def test_values_split_across_chunks(monkeypatch, chunk_size):
+    monkeypatch.setattr(permit_source, "CHUNK_SIZE", chunk_size)
+    for separators in ((",", ":"), (", ", ": ")):
+        text = json.dumps(VALUES, separators=separators)
+        assert list(iter_json_array(io.StringIO(text))) == VALUES
+
+
+def test_float_split_after_its_dot(monkeypatch):
+    monkeypatch.setattr(permit_source, "CHUNK_SIZE", 3)
+    assert list(iter_json_array(io.StringIO("[1500.0]"))) == [1500.0]
+
+
+def test_invalid_input(monkeypatch):
+    monkeypatch.setattr(permit_source, "CHUNK_SIZE", 3)
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"permit": 1}')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO("[1, 2")))
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO("[1x]")))